@@ -1,17 +1,27 @@
+import time
+
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
-from .chat_models import ChatRequest, ChatResponse, CrewResponse
-from .components import PurposeModels
-from .crew import Babynest
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from .chat_models import ChatRequest, ChatResponse, CrewResponse, JobResponse, JobStatus
+from .components import PurposeModels, Memory, retriever, groq_http_client, GENERAL_CHAT_FAILURE
+from .response_cache import SEMANTIC_CACHE_MAX_HISTORY
+from .backends import backends
+from .tracing import TracingMiddleware, metrics, span, set_tags
+from langchain_core.messages import HumanMessage, AIMessage
+from .crew_runner import crew_runner, CrewBusyError
+from .jobs import job_manager, JobQueueFull
+from .rate_limit import rate_limiter, RateLimitExceeded
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from typing import Union
+import asyncio
 import logging
 import httpx
+import math
+import json
 import os
 
 
@@ -26,13 +36,38 @@ logging.basicConfig(
 file = __name__.strip("__")
 logger = logging.getLogger(file)
 
-limiter = Limiter(key_func=get_remote_address, default_limits=["5/minute"])
+# background: serve immediately and warm backends in the background (default),
+# blocking: finish warm-up before accepting traffic, off: initialize purely on first use.
+WARMUP_MODE = os.getenv("WARMUP_MODE", "background").lower()
+IMPORT_TIME_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", "1.0"))
+# How crewai-routed chat requests are answered when the request does not say: "sync" waits
+# for the crew, "job" returns 202 with a job to poll at /api/jobs/{job_id}.
+CREWAI_RESPONSE_MODE = os.getenv("CREWAI_RESPONSE_MODE", "sync").lower()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup = None
+    if WARMUP_MODE != "off":
+        warmup = asyncio.create_task(backends.warm_up())
+        if WARMUP_MODE == "blocking":
+            await warmup
+    job_manager.start()
+    yield
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+    await job_manager.stop()
+    await groq_http_client.aclose()
+    if backends.status()["store"]["ready"]:
+        await backends.get("store").close()
+
 
 try:
     app = FastAPI(
         title="BabyNest",
         description="A pregnancy and postpartum platform backend",
-        version="0.0.1"
+        version="0.0.1",
+        lifespan=lifespan
     )
     logger.info("Successfully initialized FastAPI app")
 except Exception as e:
@@ -40,22 +75,26 @@ except Exception as e:
     raise
 
 
-async def custom_rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+RATE_LIMIT_DETAIL = "Sorry, you have exceeded the rate limit, please try again shortly."
+
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
     """Handles rate limit exceptions with a custom JSON response."""
     return JSONResponse(
         status_code=429,
-        content={"detail": "Sorry, you have exceeded the rate limit (5/minute)"}
+        content={"detail": RATE_LIMIT_DETAIL},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
     )
 
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-app.add_middleware(SlowAPIMiddleware)
 
 origins = [
     "https://baby-nest-five.vercel.app",
     "https://babynest.netlify.app"
 ]
 
+app.add_middleware(TracingMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  
@@ -67,48 +106,342 @@ app.add_middleware(
 
 assistant = PurposeModels()
 
+import_seconds = time.perf_counter() - _import_started
+if import_seconds > IMPORT_TIME_BUDGET:
+    logger.warning(f"App import took {import_seconds:.2f}s, over the {IMPORT_TIME_BUDGET:.2f}s budget")
+else:
+    logger.info(f"App imported in {import_seconds * 1000:.0f} ms")
+
 @app.get("/")
 async def root():
     return {"message": "Backend running. Visit /docs"}
 
 
-@app.post("/api/chat", response_model=Union[ChatResponse, CrewResponse])
-@limiter.limit("5/minute")
-async def chat(request: Request,chat_request: ChatRequest):
+@app.get("/ready")
+async def ready():
+    """Readiness per dependency; 503 until every required backend is initialized."""
+    await backends.recheck()
+    body = {
+        "ready": backends.ready(),
+        "import_seconds": round(import_seconds, 3),
+        "dependencies": backends.status()
+    }
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
+
+
+@app.get("/metrics")
+async def get_metrics(format: str = "prometheus"):
+    """Per-stage latency histograms in Prometheus text format, or p50/p95/p99 as JSON with ?format=json."""
+    if format == "json":
+        return metrics.snapshot()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def embed_query(query: str):
+    embeddings = await backends.aget("embeddings")
+    with span("embedding"):
+        return await embeddings.aembed_query(query)
+
+
+async def load_history(session_id: str | None):
+    return await Memory(session_id=session_id).aget_messages() if session_id else []
+
+
+async def retrieve_context(query: str, embedding_task: asyncio.Task) -> str:
     try:
-        route = await assistant.router(query=chat_request.user_request)
-        logger.info("Successfully determined route")
+        embedding = await embedding_task
     except Exception as e:
-        logger.exception(f"Failed to determine route: {e}")
-        route = "langchain"
-    if route == "langchain":
-        logger.info("Passing conversation to langchain")
+        logger.warning(f"Query embedding failed, retrieving without it: {e}")
+        embedding = None
+    with span("retrieval"):
+        return await retriever.aget_documents(query=query, embedding=embedding)
+
+
+async def remember_answer(query: str, embedding, answer: str, route: str, history: list) -> None:
+    # An answer shaped by earlier turns must never be served to another session.
+    if embedding is None or history:
+        return
+    try:
+        response_cache = await backends.aget("response_cache")
+        if response_cache is None:
+            return
+        await response_cache.store(query, embedding, answer, route)
+    except Exception as e:
+        logger.warning(f"Failed to store the answer in the semantic cache: {e}")
+
+
+def cancel_pending(*tasks: asyncio.Task) -> None:
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+
+
+class ChatPipeline:
+    """
+    Shared front half of the chat endpoints.
+    Routing, history and retrieval are independent, so they all start at once and
+    whatever the chosen route turns out not to need is cancelled.
+    """
+
+    def __init__(self, chat_request: ChatRequest):
+        self.request = chat_request
+        self.query = chat_request.user_request
+        set_tags(session=chat_request.session_id)
+        self.embedding_task = asyncio.create_task(embed_query(self.query))
+        self.history_task = asyncio.create_task(load_history(chat_request.session_id))
+        self.route_task = asyncio.create_task(assistant.router(query=self.query, embedding=self.embedding_task))
+        self.retrieval_task = asyncio.create_task(retrieve_context(self.query, self.embedding_task))
+        self.history = []
+        self.query_embedding = None
+        self.hit = None
+        self.route = None
+
+    async def _cached_answer(self):
+        """Looks the query up in the semantic cache when the conversation is still short."""
+        if len(self.history) > SEMANTIC_CACHE_MAX_HISTORY:
+            return
         try:
-            output = await assistant.general_chat(query=chat_request.user_request,session_id=chat_request.session_id)
-            logger.info("Chatbot returned an answer!")
-            return ChatResponse(output=output)
+            response_cache = await backends.aget("response_cache")
+            if response_cache is None:
+                return
+            self.query_embedding = await self.embedding_task
+            with span("semantic_cache"):
+                self.hit = await response_cache.lookup(self.query_embedding, self.query)
         except Exception as e:
-            logger.exception("Chatbot failed to return an answer!")
-            output = "Chatbot did not return an answer"
-            return ChatResponse(output=output)
-    elif route == "crewai":
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            self.query_embedding = None
+
+    async def prepare(self) -> str:
+        """Resolves history, the semantic cache and the route; returns the route (or "cache")."""
         try:
-            logger.info("Routing conversation to Crewai")
-            crew_instance = Babynest().crew()
-            response = crew_instance.kickoff(inputs={"user_query":chat_request.user_request})
-            logger.info("CrewAI executed successfully!")
-            return CrewResponse(output=response.raw)
+            self.history = await self.history_task
         except Exception as e:
-            output = "CrewAI failed"
-            logger.exception("Crew Failed")
-            return ChatResponse(output=output)
-    
+            logger.warning(f"Failed to load conversation history: {e}")
+
+        await self._cached_answer()
+        if self.hit is not None:
+            cancel_pending(self.route_task, self.retrieval_task)
+            logger.info(f"Answering from the semantic cache ({self.hit.route})")
+            if self.request.session_id:
+                await Memory(session_id=self.request.session_id).aadd_messages([
+                    HumanMessage(content=self.query),
+                    AIMessage(content=self.hit.answer)
+                ])
+            self.route = "cache"
+            set_tags(route=self.route)
+            return self.route
+
+        try:
+            self.route = await self.route_task
+            logger.info("Successfully determined route")
+        except Exception as e:
+            logger.exception(f"Failed to determine route: {e}")
+            self.route = "langchain"
+        if self.route != "langchain":
+            cancel_pending(self.retrieval_task)
+        set_tags(route=self.route)
+        return self.route
+
+    async def context(self) -> str:
+        return await self.retrieval_task
+
+    def close(self) -> None:
+        cancel_pending(self.embedding_task, self.history_task, self.route_task, self.retrieval_task)
+
+
+async def submit_job(chat_request: ChatRequest) -> JSONResponse:
+    try:
+        job, created = await job_manager.submit(chat_request.user_request, chat_request.session_id)
+    except JobQueueFull as e:
+        logger.warning(f"Rejecting job, queue full: {e}")
+        raise crew_busy_error()
+    except Exception as e:
+        logger.exception("Failed to submit the job")
+        raise HTTPException(status_code=503, detail="Research jobs are temporarily unavailable.")
+    body = JobResponse(job_id=job["job_id"], status=job["status"], status_url=f"/api/jobs/{job['job_id']}")
+    return JSONResponse(status_code=202 if created else 200, content=body.model_dump())
+
+
+def crew_busy_error() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Our research assistant is busy right now, please try again shortly.",
+        headers={"Retry-After": "30"}
+    )
+
+
+@app.post("/api/chat", response_model=Union[ChatResponse, CrewResponse, JobResponse])
+async def chat(request: Request,chat_request: ChatRequest):
+    # Every request pays for a chat up front; a crew route pays the difference once it is known.
+    await rate_limiter.check(request, chat_request.session_id, "langchain")
+    pipeline = ChatPipeline(chat_request)
+    try:
+        route = await pipeline.prepare()
+        if route == "crewai":
+            await rate_limiter.check(request, chat_request.session_id, route, paid=rate_limiter.cost("langchain"))
+        if route == "cache":
+            if pipeline.hit.route == "crewai":
+                return CrewResponse(output=pipeline.hit.answer)
+            return ChatResponse(output=pipeline.hit.answer)
+        if route == "langchain":
+            logger.info("Passing conversation to langchain")
+            try:
+                output = await assistant.general_chat(
+                    query=chat_request.user_request,
+                    session_id=chat_request.session_id,
+                    history=pipeline.history,
+                    context=await pipeline.context()
+                )
+                logger.info("Chatbot returned an answer!")
+                if output != GENERAL_CHAT_FAILURE:
+                    await remember_answer(chat_request.user_request, pipeline.query_embedding, output, route, pipeline.history)
+                return ChatResponse(output=output)
+            except Exception as e:
+                logger.exception("Chatbot failed to return an answer!")
+                output = "Chatbot did not return an answer"
+                return ChatResponse(output=output)
+        elif route == "crewai":
+            if (chat_request.mode or CREWAI_RESPONSE_MODE) == "job":
+                logger.info("Queueing the crew request as a job")
+                return await submit_job(chat_request)
+            try:
+                logger.info("Routing conversation to Crewai")
+                response = await crew_runner.run(chat_request.user_request, embedding=pipeline.query_embedding)
+                logger.info("CrewAI executed successfully!")
+                await remember_answer(chat_request.user_request, pipeline.query_embedding, response.raw, route, pipeline.history)
+                return CrewResponse(output=response.raw)
+            except CrewBusyError as e:
+                logger.warning(f"Rejecting crew request, pool saturated: {e}")
+                raise crew_busy_error()
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=504, detail="The research request took too long to complete.")
+            except Exception as e:
+                output = "CrewAI failed"
+                logger.exception("Crew Failed")
+                return ChatResponse(output=output)
+    finally:
+        pipeline.close()
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_crew(query: str, embedding=None):
+    """Yields crew progress events while the crew runs, then the final output."""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    run_task = asyncio.create_task(
+        crew_runner.run(
+            query,
+            on_event=lambda event: loop.call_soon_threadsafe(events.put_nowait, event),
+            embedding=embedding
+        )
+    )
+    try:
+        while not run_task.done():
+            next_event = asyncio.create_task(events.get())
+            await asyncio.wait({next_event, run_task}, return_when=asyncio.FIRST_COMPLETED)
+            if next_event.done():
+                yield "progress", next_event.result()
+            else:
+                next_event.cancel()
+        while not events.empty():
+            yield "progress", events.get_nowait()
+        response = run_task.result()
+        yield "done", {"output": response.raw}
+    finally:
+        cancel_pending(run_task)
+
+
+async def stream_chat(request: Request, chat_request: ChatRequest):
+    pipeline = ChatPipeline(chat_request)
+    query = chat_request.user_request
+    try:
+        route = await pipeline.prepare()
+        if route == "crewai":
+            await rate_limiter.check(request, chat_request.session_id, route, paid=rate_limiter.cost("langchain"))
+        if route == "cache":
+            yield sse("route", {"route": pipeline.hit.route, "cached": True})
+            yield sse("done", {"output": pipeline.hit.answer})
+            return
+
+        yield sse("route", {"route": route, "cached": False})
+        if route == "langchain":
+            parts = []
+            async for token in assistant.general_chat_stream(
+                query=query,
+                session_id=chat_request.session_id,
+                history=pipeline.history,
+                context=await pipeline.context()
+            ):
+                parts.append(token)
+                yield sse("token", {"text": token})
+            output = "".join(parts)
+            await remember_answer(query, pipeline.query_embedding, output, route, pipeline.history)
+            yield sse("done", {"output": output})
+        elif route == "crewai":
+            async for event, data in stream_crew(query, pipeline.query_embedding):
+                if event == "done":
+                    await remember_answer(query, pipeline.query_embedding, data["output"], route, pipeline.history)
+                yield sse(event, data)
+    except RateLimitExceeded as e:
+        yield sse("error", {"status": 429, "detail": RATE_LIMIT_DETAIL, "retry_after": math.ceil(e.retry_after)})
+    except CrewBusyError:
+        yield sse("error", {"status": 503, "detail": "Our research assistant is busy right now, please try again shortly."})
+    except asyncio.TimeoutError:
+        yield sse("error", {"status": 504, "detail": "The research request took too long to complete."})
+    except Exception as e:
+        logger.exception("Streaming chat failed")
+        yield sse("error", {"status": 500, "detail": "Chatbot did not return an answer"})
+    finally:
+        pipeline.close()
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: Request, chat_request: ChatRequest):
+    """
+    Server-Sent Events variant of /api/chat.
+    Emits `route`, then `token` events (langchain) or `progress` events (crewai),
+    and finally `done` with the full answer or `error`.
+    """
+    await rate_limiter.check(request, chat_request.session_id, "langchain")
+    return StreamingResponse(
+        stream_chat(request, chat_request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/jobs", status_code=202, response_model=JobResponse)
+async def create_job(request: Request, chat_request: ChatRequest):
+    """
+    Queues a crew research request and returns its job ID at once.
+    An identical query from the same session while its job is still queued or running
+    returns that job (200) instead of starting another.
+    """
+    await rate_limiter.check(request, chat_request.session_id, "crewai")
+    return await submit_job(chat_request)
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    try:
+        job = await job_manager.get(job_id)
+    except Exception as e:
+        logger.error(f"Failed to read job {job_id}: {e}")
+        raise HTTPException(status_code=503, detail="Job status is temporarily unavailable.")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return JobStatus(**job)
+
 
 @app.post("/api/n8n_webhook")
 async def handle_n8n_webhook(request: Request):
     """
     Endpoint to receive data and forward it to the n8n webhook.
     """
+    await rate_limiter.check(request, None, "webhook")
     try:
         data = await request.json()
         logger.info(f"Received data for n8n webhook: {data}")
@@ -0,0 +1,149 @@
+import threading
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Backends:
+    """
+    Registry of lazily created service clients.
+    Nothing is built at import time: each backend is created on first use (or by warm_up)
+    and its readiness and last error are tracked per dependency. Tests and benchmarks
+    can swap any backend for a stand-in with override().
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._checks = {}
+        self._required = set()
+        self._instances = {}
+        self._errors = {}
+        self._init_seconds = {}
+        self._lock = threading.Lock()
+        self._name_locks = {}
+        self._building = set()
+        self._warmed_at = {}
+
+    def register(self, name: str, factory, check=None, required: bool = True) -> None:
+        """
+        Registers a factory. `check` is an optional coroutine function run by warm_up
+        against the instance (e.g. a Redis ping) before the backend is reported ready.
+        """
+        self._factories[name] = factory
+        if check is not None:
+            self._checks[name] = check
+        if required:
+            self._required.add(name)
+
+    def get(self, name: str):
+        if name in self._instances:
+            return self._instances[name]
+        with self._lock:
+            name_lock = self._name_locks.setdefault(name, threading.Lock())
+        # One lock per backend: slow backends can warm up in parallel while
+        # concurrent first uses of the same backend still build it only once.
+        with name_lock:
+            if name in self._instances:
+                return self._instances[name]
+            started = time.perf_counter()
+            try:
+                instance = self._factories[name]()
+            except Exception as e:
+                self._errors[name] = str(e)
+                logger.exception(f"Failed to initialize {name}")
+                raise
+            self._init_seconds[name] = time.perf_counter() - started
+            self._errors.pop(name, None)
+            self._instances[name] = instance
+            logger.info(f"Initialized {name} in {self._init_seconds[name] * 1000:.0f} ms")
+            return instance
+
+    async def aget(self, name: str):
+        """Async accessor: a backend that still has to be built is built off the event loop."""
+        if name in self._instances:
+            return self._instances[name]
+        return await asyncio.to_thread(self.get, name)
+
+    def peek(self, name: str, build: bool = False):
+        """
+        Returns the backend if it is already built, else None without waiting.
+        With `build`, a missing backend is started in a background thread for later calls.
+        """
+        if name in self._instances:
+            return self._instances[name]
+        if build:
+            with self._lock:
+                if name in self._building:
+                    return None
+                self._building.add(name)
+            threading.Thread(target=self._build_in_background, args=(name,), daemon=True).start()
+        return None
+
+    def _build_in_background(self, name: str) -> None:
+        try:
+            self.get(name)
+        except Exception:
+            pass  # Already logged and recorded by get().
+        finally:
+            with self._lock:
+                self._building.discard(name)
+
+    def override(self, name: str, instance) -> None:
+        with self._lock:
+            self._instances[name] = instance
+            self._errors.pop(name, None)
+
+    def reset(self, name: str | None = None) -> None:
+        with self._lock:
+            for key in [name] if name else list(self._instances):
+                self._instances.pop(key, None)
+                self._errors.pop(key, None)
+
+    async def _warm(self, name: str) -> None:
+        self._warmed_at[name] = time.monotonic()
+        try:
+            instance = await self.aget(name)
+            check = self._checks.get(name)
+            if check is not None:
+                await check(instance)
+                self._errors.pop(name, None)
+        except Exception as e:
+            self._errors[name] = str(e)
+            logger.warning(f"Warm-up of {name} failed: {e}")
+
+    async def warm_up(self, names: list[str] | None = None) -> None:
+        """Initializes (and checks) backends concurrently; failures are recorded, never raised."""
+        await asyncio.gather(*(self._warm(name) for name in names or list(self._factories)))
+
+    async def recheck(self, min_interval: float = 10.0) -> None:
+        """
+        Retries warm-up for every backend whose last build or check failed, at most once per
+        `min_interval` seconds each, so a dependency that recovers is reported ready again.
+        """
+        now = time.monotonic()
+        failed = [
+            name for name in list(self._errors)
+            if name in self._factories and now - self._warmed_at.get(name, 0.0) >= min_interval
+        ]
+        if failed:
+            await self.warm_up(failed)
+
+    def status(self) -> dict:
+        return {
+            name: {
+                "ready": name in self._instances and name not in self._errors,
+                "required": name in self._required,
+                "error": self._errors.get(name),
+                "init_ms": round(self._init_seconds[name] * 1000, 1) if name in self._init_seconds else None,
+            }
+            for name in self._factories
+        }
+
+    def ready(self) -> bool:
+        status = self.status()
+        return all(status[name]["ready"] for name in self._required if name in status)
+
+
+backends = Backends()
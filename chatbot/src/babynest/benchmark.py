@@ -0,0 +1,415 @@
+"""
+Offline load test and microbenchmarks for the BabyNest API.
+
+Every external service (Groq, Cohere, Chroma, Tavily, Upstash and the CrewAI crew) is replaced
+with a deterministic local stand-in through `backends.override`, each with configurable latency,
+so runs need no API keys or network and are comparable between commits.
+
+    PYTHONPATH=src python -m babynest.benchmark --requests 400 --concurrency 40 --crew-ratio 0.1
+"""
+import tempfile
+import os
+
+# Set before the app is imported: the benchmark warms nothing, keeps logs quiet
+# and never writes its synthetic queries into the real routing log.
+os.environ.setdefault("WARMUP_MODE", "off")
+os.environ.setdefault("TRACE_LOG", "false")
+os.environ.setdefault("ROUTER_LOG_PATH", os.path.join(tempfile.mkdtemp(prefix="babynest-bench-"), "routing_log.jsonl"))
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import InMemoryVectorStore
+from langchain_core.documents import Document
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable
+import statistics
+import argparse
+import hashlib
+import logging
+import asyncio
+import random
+import json
+import math
+import time
+
+CREW_MARKER = "detailed research report"
+CREW_ANSWER_MARKER = "## Research summary"
+
+LANGCHAIN_QUERIES = [
+    "Is it normal to feel tired all the time in week 8?",
+    "What can I eat to help with morning sickness?",
+    "How much water should I drink while pregnant?",
+    "Any tips for sleeping better in the third trimester?",
+    "What does BabyNest help with?",
+]
+CREW_QUERIES = [
+    f"Write a {CREW_MARKER} on gestational diabetes screening.",
+    f"I need a {CREW_MARKER} about postpartum depression and what other mothers experienced.",
+]
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model answering through `respond(prompt_text)` after `latency` seconds, streaming word by word."""
+
+    respond: Callable[[str], str]
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "babynest-stub"
+
+    def _answer(self, messages) -> str:
+        return self.respond("\n".join(str(m.content) for m in messages))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for word in self._answer(messages).split(" "):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+def route_for(prompt: str) -> str:
+    return "crewai" if CREW_MARKER in prompt else "langchain"
+
+
+def general_answer(prompt: str) -> str:
+    return "Congratulations on your pregnancy! Rest when you can, stay hydrated and keep your prenatal appointments. " * 2
+
+
+class StubEmbeddings(Embeddings):
+    """Deterministic hash-seeded unit vectors; the same text always gets the same vector."""
+
+    def __init__(self, dimensions: int = 64, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def _vector(self, text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.sha256(" ".join(text.lower().split()).encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        vector = [rng.gauss(0, 1) for _ in range(self.dimensions)]
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self.latency)
+        return self._vector(text)
+
+
+@dataclass
+class StubTaskOutput:
+    agent: str
+    summary: str
+
+
+@dataclass
+class StubCrewOutput:
+    raw: str
+
+
+class StubCrew:
+    """Stands in for a kicked-off Babynest crew: three tasks that each take `latency / 3` seconds."""
+
+    agents = ("Routing Agent", "Maternal Health Researcher", "Personalized Health Communicator")
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.task_callback = None
+
+    def kickoff(self, inputs: dict):
+        for agent in self.agents:
+            time.sleep(self.latency / len(self.agents))
+            if self.task_callback is not None:
+                self.task_callback(StubTaskOutput(agent=agent, summary=f"{agent} finished"))
+        query = inputs.get('user_query', '')
+        return StubCrewOutput(raw=(
+            f"{CREW_ANSWER_MARKER}\n\nHere is what the sources say about: {query}\n\n"
+            "* Most symptoms are common and usually mild.\n"
+            "* Rest, hydration and regular meals help.\n\n"
+            "Talk to your midwife if anything worries you."
+        ))
+
+
+class StubCrewPool:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    @contextmanager
+    def acquire(self, run=None):
+        yield StubCrew(self.latency)
+
+    def synthesize(self, draft: str, user_query: str) -> str:
+        time.sleep(self.latency / 3)
+        return draft
+
+
+def sample_documents(count: int = 200) -> list[Document]:
+    rng = random.Random(7)
+    topics = ["nausea", "folic acid", "sleep", "hydration", "preeclampsia", "gestational diabetes", "back pain", "iron"]
+    docs = []
+    for i in range(count):
+        topic = topics[i % len(topics)]
+        body = " ".join(rng.choice(["pregnancy", "week", str(rng.randint(1, 40)), topic, "care", "doctor", "baby", "healthy"]) for _ in range(80))
+        docs.append(Document(page_content=f"About {topic}: {body}.", metadata={"source": f"https://example.org/{topic.replace(' ', '-')}/{i // len(topics)}"}))
+    return docs
+
+
+def install_stubs(args) -> None:
+    """Points every backend at its local stand-in."""
+    from .backends import backends
+    from .redis_store import InMemoryStore
+    from .response_cache import LocalSemanticCache
+    from .web_search import CachedSearchClient, OfflineSearchClient
+
+    embeddings = StubEmbeddings(latency=args.embed_latency)
+    vector_store = InMemoryVectorStore(embedding=embeddings)
+    vector_store.add_documents(sample_documents())
+
+    backends.override("embeddings", embeddings)
+    backends.override("vector_store", vector_store)
+    backends.override("lexical_index", None)
+    # Hash embeddings carry no meaning, so a classifier built on them would route at random;
+    # without it the stub LLM router decides, deterministically.
+    backends.override("router_classifier", None)
+    backends.override("store", InMemoryStore())
+    backends.override("response_cache", LocalSemanticCache() if args.semantic_cache else None)
+    backends.override("web_search", CachedSearchClient(OfflineSearchClient(latency=args.search_latency)))
+    backends.override("router_llm", StubChatModel(respond=route_for, latency=args.llm_latency))
+    backends.override("general_llm", StubChatModel(respond=general_answer, latency=args.llm_latency, token_latency=args.token_latency))
+    backends.override("crew_pool", StubCrewPool(latency=args.crew_latency))
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.fmean(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2) if values else 0.0,
+    }
+
+
+class LoopLagMonitor:
+    """
+    Measures how late a periodic timer fires. Any lateness well beyond the interval means
+    something blocked the event loop (a sync network call, heavy CPU work, ...).
+    """
+
+    def __init__(self, interval: float = 0.005, threshold: float = 0.01):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: list[float] = []
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(loop.time() - expected, 0.0))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        blocked = [lag for lag in self.lags if lag > self.threshold]
+        return {
+            **summarize(self.lags),
+            "blocked_events": len(blocked),
+            "blocked_total_ms": round(sum(blocked) * 1000, 2),
+        }
+
+
+async def run_load(args) -> dict:
+    import httpx
+    from . import app as app_module
+    from .tracing import metrics
+
+    # The benchmark is a single client, so per-IP rate limits would reject almost everything.
+    app_module.rate_limiter.enabled = False
+    metrics.reset()
+    path = "/api/chat/stream" if args.stream else "/api/chat"
+    rng = random.Random(args.seed)
+    plan = [
+        ("crewai", rng.choice(CREW_QUERIES)) if rng.random() < args.crew_ratio else ("langchain", rng.choice(LANGCHAIN_QUERIES))
+        for _ in range(args.requests)
+    ]
+    queue = asyncio.Queue()
+    for index, item in enumerate(plan):
+        queue.put_nowait((index, *item))
+    results = {"langchain": [], "crewai": []}
+    statuses = {}
+    misrouted = {}
+
+    async def worker(client) -> None:
+        while not queue.empty():
+            index, route, query = queue.get_nowait()
+            body = {"user_request": query, "session_id": f"bench-{index % args.sessions}"}
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                await response.aread()
+                status = response.status_code
+                if args.stream and b"event: error" in response.content:
+                    status = 599
+            except Exception:
+                status = 0
+            elapsed = time.perf_counter() - started
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                # Filed under the route the app actually took, which is not always the planned one.
+                taken = "crewai" if CREW_ANSWER_MARKER.encode() in response.content else "langchain"
+                if taken != route:
+                    misrouted[route] = misrouted.get(route, 0) + 1
+                results[taken].append(elapsed)
+
+    monitor = LoopLagMonitor()
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        monitor.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        wall = time.perf_counter() - started
+        loop_lag = await monitor.stop()
+
+    ok = sum(len(values) for values in results.values())
+    return {
+        "endpoint": path,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(ok / wall, 2) if wall else 0.0,
+        "statuses": {str(key): value for key, value in sorted(statuses.items())},
+        "misrouted": misrouted,
+        "latency": {route: summarize(values) for route, values in results.items() if values},
+        "event_loop_lag": loop_lag,
+        "stages": metrics.snapshot(),
+    }
+
+
+def time_it(func, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    result = summarize(samples)
+    result["ops_per_second"] = round(iterations / sum(samples), 1) if sum(samples) else 0.0
+    return result
+
+
+async def atime_it(func, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started)
+    result = summarize(samples)
+    result["ops_per_second"] = round(iterations / sum(samples), 1) if sum(samples) else 0.0
+    return result
+
+
+async def run_micro(args) -> dict:
+    from .components import Memory, PurposeModels, retriever, general_chat_prompt
+    from .context import assemble_context
+
+    iterations = args.iterations
+    messages = [HumanMessage(content=query) if i % 2 == 0 else AIMessage(content=general_answer(query))
+                for i, query in enumerate(LANGCHAIN_QUERIES * 4)]
+    serialized = [Memory._serialize(m) for m in messages]
+    memory = Memory(session_id="bench-micro")
+    await memory.aadd_messages(messages)
+    history = await memory.aget_messages()
+    docs = sample_documents(8)
+    query = LANGCHAIN_QUERIES[0]
+    context = assemble_context(docs)
+
+    return {
+        "memory_serialize": time_it(lambda: [Memory._serialize(m) for m in messages], iterations),
+        "memory_deserialize": time_it(lambda: [Memory._deserialize(raw) for raw in serialized], iterations),
+        "memory_append": await atime_it(lambda: memory.aadd_messages(messages[:2]), iterations),
+        "memory_read": await atime_it(memory.aget_messages, iterations),
+        "get_documents": time_it(lambda: retriever.get_documents(query), iterations),
+        "context_assembly": time_it(lambda: assemble_context(docs), iterations),
+        "prompt_assembly": time_it(lambda: general_chat_prompt.format_messages(
+            context=context,
+            user_query=query,
+            history=PurposeModels.format_history(history),
+        ), iterations),
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline BabyNest load test and microbenchmarks.")
+    parser.add_argument("--suite", choices=["all", "load", "micro"], default="all")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=50, help="Distinct session IDs the requests rotate through.")
+    parser.add_argument("--crew-ratio", type=float, default=0.1, help="Share of requests routed to the crew.")
+    parser.add_argument("--stream", action="store_true", help="Load /api/chat/stream instead of /api/chat.")
+    parser.add_argument("--semantic-cache", action="store_true", help="Enable the in-process semantic cache.")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--crew-latency", type=float, default=0.6)
+    parser.add_argument("--iterations", type=int, default=500, help="Iterations per microbenchmark.")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser
+
+
+async def run(args) -> dict:
+    install_stubs(args)
+    report = {}
+    if args.suite in ("all", "micro"):
+        report["micro"] = await run_micro(args)
+    if args.suite in ("all", "load"):
+        report["load"] = await run_load(args)
+    return report
+
+
+def main():
+    args = build_parser().parse_args()
+    # Installing the root handler first turns the app modules' basicConfig(level=INFO) into no-ops.
+    logging.basicConfig(level=logging.WARNING, force=True)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
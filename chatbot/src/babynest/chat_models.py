@@ -1,8 +1,10 @@
 from pydantic import BaseModel, Field
+from typing import Literal
 
 class ChatRequest(BaseModel):
     user_request: str = Field(..., min_length=1, max_length=1000)
     session_id: str | None = Field(None, min_length=1, max_length=50)
+    mode: Literal["sync", "job"] | None = None
 
 class ChatResponse(BaseModel):
     output: str
@@ -11,4 +13,17 @@ class CrewResponse(BaseModel):
     output: object
 
 class SessionEndRequest(BaseModel):
-    session_id: str = Field(..., min_length=1, max_length=50)
\ No newline at end of file
+    session_id: str = Field(..., min_length=1, max_length=50)
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    output: str | None = None
+    error: str | None = None
+    created_at: float
+    updated_at: float
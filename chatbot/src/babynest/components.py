@@ -1,17 +1,25 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_cohere import CohereEmbeddings
-from langchain_chroma import Chroma
-from langchain_groq import ChatGroq
-from tavily import TavilyClient
 import logging
 import asyncio
+import inspect
+import httpx
 import json
+import time
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-from upstash_redis import Redis
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from .backends import backends
+from .embedding_cache import CachedEmbeddings
+from .response_cache import create_response_cache
+from .redis_store import create_store
+from .lexical_index import BM25Index, reciprocal_rank_fusion
+from .context import assemble_context
+from .web_search import create_search_client
+from .tracing import span, record
+from .routing import CentroidRouter, RoutingLog, ROUTER_EXAMPLES, keyword_route, normalize_route
 
 load_dotenv()
 
@@ -27,53 +35,155 @@ project_root = Path(__file__).resolve().parent.parent.parent
 knowledge_directory = project_root/"knowledge"
 db_directory = project_root/"db"
 
-try:
-    embeddings = CohereEmbeddings(
-    model="embed-english-v3.0",
-    cohere_api_key=os.getenv("COHERE_API_KEY")
-)
+lexical_index_directory = Path(os.getenv("LEXICAL_INDEX_PATH", db_directory/"bm25"))
+
+routing_log = RoutingLog(os.getenv("ROUTER_LOG_PATH", db_directory/"routing_log.jsonl"))
+
+embedding_model = "embed-english-v3.0"
+embedding_cache_path = Path(os.getenv("EMBEDDING_CACHE_PATH", db_directory/"embedding_cache.sqlite3"))
+
+# Every external service is created on first use (or by the app's warm-up hook) through
+# `backends`, so importing this module costs no network calls and no heavy SDK imports.
+
+def _create_embeddings():
+    from langchain_cohere import CohereEmbeddings
+
+    embeddings = CachedEmbeddings(
+        CohereEmbeddings(
+            model=embedding_model,
+            cohere_api_key=os.getenv("COHERE_API_KEY")
+        ),
+        model_name=embedding_model,
+        cache_path=embedding_cache_path,
+        max_memory_items=int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+    )
     logger.info("Successfully initialized Generative AI embeddings.")
-except Exception as e:
-    embeddings=None
-    logger.error("Encountered an error in loading the embedding model!")
+    return embeddings
+
+
+def _create_vector_store():
+    from langchain_chroma import Chroma
 
-try:
     stored_data = Chroma(
-    persist_directory=db_directory,
-    embedding_function=embeddings   
-)
+        persist_directory=db_directory,
+        embedding_function=get_embeddings()
+    )
     logger.info("Successfully connected to the vector database")
-except Exception as e:
-    logger.exception("Failed to load vector db")
+    return stored_data
+
 
-try:
+def _create_search_client():
     logger.info("Setting up Tavily for web search.")
-    client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+    client = create_search_client()
     logger.info("Successfully set up Tavily client")
-except Exception as e:
-    logger.exception("Failed to set up Tavily client.")
-
-try:
-    logger.info("Setting up Redis")
-    redis = Redis(url=os.getenv("UPSTASH_REDIS_REST_URL"), token=os.getenv("UPSTASH_REDIS_REST_TOKEN"))
-    redis.set("redis_check","online", ex=60)
-    logger.info("Successful")
-except Exception as e:
-    logger.exception(f"Failed to set up Redis: {e}")
-    
+    return client
+
+
+def _create_store():
+    store = create_store()
+    logger.info(f"Using the {store.name} conversation store")
+    return store
+
+
+async def _check_store(store) -> None:
+    if not await store.ping():
+        raise ConnectionError("Redis did not answer PING")
+
+
+backends.register("embeddings", _create_embeddings)
+backends.register("vector_store", _create_vector_store)
+backends.register("store", _create_store, check=_check_store)
+backends.register("response_cache", lambda: create_response_cache(store=get_store()), required=False)
+backends.register("web_search", _create_search_client, required=False)
+backends.register("lexical_index", lambda: BM25Index.load(lexical_index_directory), required=False)
+backends.register(
+    "router_classifier",
+    lambda: CentroidRouter.build(get_embeddings(), ROUTER_EXAMPLES + routing_log.examples()),
+    required=False
+)
+
+
+def get_embeddings():
+    return backends.get("embeddings")
+
+
+def get_vector_store():
+    return backends.get("vector_store")
+
+
+def get_search_client():
+    return backends.get("web_search")
+
+
+def get_store():
+    return backends.get("store")
+
+
+def get_response_cache():
+    return backends.get("response_cache")
+
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "5"))
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
 
 
 class ContentRetriever():
-    def get_documents(self, query: str) -> str:
+    """
+    Retrieves knowledge chunks from Chroma. In hybrid mode (RETRIEVAL_MODE) the vector hits are
+    fused by reciprocal rank with BM25 hits from the lexical index built at ingest time, so exact
+    terms such as drug names and week numbers are not lost in the embedding.
+    """
+
+    def search(self, query: str, embedding, k: int = RETRIEVAL_K) -> list[Document]:
+        stored_data = get_vector_store()
+        lexical_index = backends.get("lexical_index") if RETRIEVAL_MODE == "hybrid" else None
+        if lexical_index is None:
+            with span("retrieval.vector"):
+                return stored_data.similarity_search_by_vector(embedding, k=k)
+
+        with span("retrieval.vector"):
+            vector_docs = stored_data.similarity_search_by_vector(embedding, k=RETRIEVAL_CANDIDATES)
+        with span("retrieval.bm25"):
+            lexical_ids = [doc_id for doc_id, _ in lexical_index.search(query, k=RETRIEVAL_CANDIDATES)]
+        docs = {doc.id: doc for doc in vector_docs if doc.id}
+        fused_ids = reciprocal_rank_fusion([[doc.id for doc in vector_docs if doc.id], lexical_ids], k=RRF_K)[:k]
+
+        missing = [doc_id for doc_id in fused_ids if doc_id not in docs]
+        if missing:
+            with span("retrieval.fetch"):
+                fetched = stored_data.get(ids=missing, include=["documents", "metadatas"])
+            for doc_id, content, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+                docs[doc_id] = Document(id=doc_id, page_content=content, metadata=metadata or {})
+        return [docs[doc_id] for doc_id in fused_ids if doc_id in docs]
+
+    def get_documents(self, query: str, route: str = "langchain") -> str:
         try:
-            docs = stored_data.similarity_search(query=query, k=5)
-            return "\n\n".join(doc.page_content for doc in docs)
+            docs = self.search(query, get_embeddings().embed_query(query))
+            return assemble_context(docs, route=route)
+        except Exception as e:
+            logger.exception("Failed to retrieve documents from Chroma.")
+            return ""
+
+    async def aget_documents(self, query: str, embedding=None, route: str = "langchain") -> str:
+        """
+        Async variant of get_documents: the query is embedded with the async Cohere client
+        (or a precomputed embedding is used) and only the local index searches run in a thread.
+        The chunks are deduplicated and cut to the route's context budget.
+        """
+        try:
+            if embedding is None:
+                embedding = await (await backends.aget("embeddings")).aembed_query(query)
+            await backends.aget("vector_store")
+            docs = await asyncio.to_thread(self.search, query, embedding)
+            return assemble_context(docs, route=route)
         except Exception as e:
             logger.exception("Failed to retrieve documents from Chroma.")
             return ""
     
     def web_search_tool(self,query):
-        results = client.search(query=query, max_results=7)
+        results = get_search_client().search(query=query, max_results=7)
         logger.info("Tavily query successfull.")
         formatted_results = []
         for x in results["results"]:
@@ -84,108 +194,112 @@ class ContentRetriever():
 
 retriever = ContentRetriever()
 
+MEMORY_WINDOW = int(os.getenv("MEMORY_WINDOW", "10"))
+# The list holds exactly the prompt's window, so a message leaving the window goes straight
+# into the summary and no turn is ever in neither.
+MEMORY_MAX_MESSAGES = MEMORY_WINDOW
+MEMORY_TTL = int(os.getenv("MEMORY_TTL", str(7 * 24 * 3600)))
+MEMORY_SUMMARY_MAX_CHARS = int(os.getenv("MEMORY_SUMMARY_MAX_CHARS", "1500"))
+
+
 class Memory():
+    """
+    Conversation history stored as a Redis list of JSON messages, through the async store.
+    Appends are a single RPUSH + LTRIM + EXPIRE transaction, so concurrent requests for the
+    same session never overwrite each other, and reads only fetch the window the prompt uses.
+    Messages trimmed off the list are folded into a compact rolling summary.
+    """
+
     def __init__(self, session_id: str):
         self.session_id = session_id
-
-    def _get_messages_sync(self) -> list[BaseMessage]:
-        """Fetches and deserializes messages from Redis using the session_id key."""
-        raw = redis.get(self.session_id)
-        if not raw:
-            return []
+        self.key = f"babynest:history:{session_id}"
+        self.summary_key = f"babynest:summary:{session_id}"
+
+    @staticmethod
+    def _serialize(message: BaseMessage) -> str:
+        msg_type = "human" if isinstance(message, HumanMessage) else "ai"
+        return json.dumps({"type": msg_type, "content": message.content})
+
+    @staticmethod
+    def _deserialize(raw: str) -> BaseMessage:
+        m = json.loads(raw)
+        if m["type"] == "human":
+            return HumanMessage(content=m["content"])
+        return AIMessage(content=m["content"])
+
+    @staticmethod
+    def _summarize(raw_messages: list[str]) -> str:
+        """Compacts trimmed messages into short one-line entries for the rolling summary."""
+        lines = []
+        for raw in raw_messages:
+            try:
+                m = json.loads(raw)
+            except Exception:
+                continue
+            speaker = "User" if m["type"] == "human" else "Assistant"
+            content = " ".join(str(m["content"]).split())
+            if len(content) > 160:
+                content = content[:157] + "..."
+            lines.append(f"{speaker}: {content}\n")
+        return "".join(lines)
+
+    async def aget_messages(self, window: int = MEMORY_WINDOW) -> list[BaseMessage]:
+        """Fetches the last `window` messages and the rolling summary in one round-trip."""
         try:
-            messages_data = json.loads(raw)
-            logger.info(f"This is the raw_output as stored in the db: {raw}")
-            messages = []
-            for m in messages_data:
-                if m["type"] == "human":
-                    messages.append(HumanMessage(content=m["content"]))
-                else:
-                    messages.append(AIMessage(content=m["content"]))
-            return messages
+            store = await backends.aget("store")
+            with span("history.read"):
+                raw_messages, summary = await store.pipeline([
+                    ("lrange", self.key, -window, -1),
+                    ("get", self.summary_key),
+                ])
         except Exception as e:
-            logger.warning(f"Failed to parse Redis history for session {self.session_id}: {e}")
+            logger.warning(f"Failed to load Redis history for session {self.session_id}: {e}")
             return []
-        
-    def _save_messages_sync(self, messages: list[BaseMessage]):
-        """Serializes and saves the complete list of messages to Redis with expiry."""
+        messages = []
+        if summary:
+            messages.append(SystemMessage(content=summary))
+        for raw in raw_messages or []:
+            try:
+                messages.append(self._deserialize(raw))
+            except Exception as e:
+                logger.warning(f"Failed to parse Redis history for session {self.session_id}: {e}")
+        return messages
+
+    @span("history.write")
+    async def aadd_messages(self, messages: list[BaseMessage]) -> None:
+        """Appends messages with one transaction; only long sessions pay a second trip for the summary."""
         try:
-            serialized = []
-            for m in messages:
-                # Serialize BaseMessage objects into simple dictionaries
-                msg_type = "human" if isinstance(m, HumanMessage) else "ai"
-                serialized.append({"type": msg_type, "content": m.content }) 
-            
-            # Save the JSON string to Redis, setting the key to expire
-            redis.set(self.session_id, json.dumps(serialized))
+            store = await backends.aget("store")
+            _, overflow, _, _ = await store.pipeline([
+                ("rpush", self.key, *[self._serialize(m) for m in messages]),
+                # Everything before the last MEMORY_MAX_MESSAGES entries is about to be trimmed.
+                ("lrange", self.key, 0, -(MEMORY_MAX_MESSAGES + 1)),
+                ("ltrim", self.key, -MEMORY_MAX_MESSAGES, -1),
+                ("expire", self.key, MEMORY_TTL),
+            ], transaction=True)
+            if overflow:
+                await self._extend_summary(overflow)
         except Exception as e:
             logger.error(f"Failed to save Redis history for session {self.session_id}: {e}")
 
-    @property
-    def messages(self) -> list[BaseMessage]: 
-        """Synchronous getter for conversation history (required by LangChain interface)."""
-        return self._get_messages_sync()
-    
-    def add_messages(self, messages: list[BaseMessage]) -> None:
-        """Appends new messages and saves the entire history synchronously."""
-        current_messages = self._get_messages_sync()
-        current_messages.extend(messages)
-        self._save_messages_sync(current_messages)
-        
-    def clear(self) -> None:
-        """Clears all messages synchronously by deleting the key."""
-        redis.delete(self.session_id)
-
-    async def aget_messages(self) -> list[BaseMessage]:
-        """Loads history asynchronously using a thread pool to avoid blocking the event loop."""
-        return await asyncio.to_thread(self._get_messages_sync)
-    
-    async def aadd_messages(self, messages: list[BaseMessage]) -> None:
-        """Adds and saves messages asynchronously."""
-        current_messages = await self.aget_messages()
-        current_messages.extend(messages)
-        await asyncio.to_thread(self._save_messages_sync, current_messages)
+    async def _extend_summary(self, overflow: list[str]) -> None:
+        store = await backends.aget("store")
+        length, _ = await store.pipeline([
+            ("append", self.summary_key, self._summarize(overflow)),
+            ("expire", self.summary_key, MEMORY_TTL),
+        ])
+        if length > MEMORY_SUMMARY_MAX_CHARS:
+            # Keep only the most recent part of the summary.
+            summary = await store.call("getrange", self.summary_key, -MEMORY_SUMMARY_MAX_CHARS, -1)
+            await store.call("setex", self.summary_key, MEMORY_TTL, summary[summary.find("\n") + 1:])
 
     async def aclear(self) -> None:
-        """Clears messages asynchronously."""
-        await asyncio.to_thread(self.clear)
+        """Clears messages and the summary."""
+        store = await backends.aget("store")
+        await store.call("delete", self.key, self.summary_key)
 
-class AIModels():
-    async def router_model(self):
-        try:
-            load_dotenv()
-            logger.info("Connecting to the router LLM...")
-            load_dotenv()
-            router_llm = ChatGroq(
-                model=os.getenv("ROUTER_MODEL"),
-                # model = "llama-3.3-70b-versatile",
-                api_key=os.getenv("GROQ_API_KEY"),
-                temperature=0.7
-            )
-            logger.info("Successfully connected to router llm")
-            return  router_llm
-        except Exception as e:
-            logger.exception("Failed to connect to the routing llm")
-            return "Could not set up routing AI model"
-        
-    async def general_model(self):
-        try:
-            logger.info("Connecting to general chat LLM")
-            general_llm = ChatGroq(
-                model=os.getenv("GENERAL_MODEL"),
-                api_key=os.getenv("GROQ_API_KEY"),
-                temperature=0.7,
-                streaming=True
-            )
-            return general_llm
-        except Exception as e:
-            logger.critical("Failed to connect to the general chat LLM")
-            return "Coild not connect to the general chat LLM"
-models = AIModels()
-
-class PurposeModels():
-    async def router(self,query):
-        router_template = ChatPromptTemplate.from_template("""
+# Built once at import: the templates are parsed a single time and reused by every request.
+router_prompt = ChatPromptTemplate.from_template("""
         You are **BabyNest's Intelligent Routing System**.  
         Your goal is to deeply analyze the user's message and decide the correct processing route.
 
@@ -215,25 +329,8 @@ class PurposeModels():
         ### User Query:
         {input}
         """)
-        
-        try:
-            router_llm = await models.router_model()
-            router_chain = router_template | router_llm | StrOutputParser()
-            route = await router_chain.ainvoke({"input": query})
-            logger.info(f"Successfully determined route: {route}")
-            return route
-        except Exception as e:
-            logger.exception("Failed to authoritatively determine the route. Proceeding with langchain")
-            return "langchain"
-        
-    async def general_chat(self, query, session_id):
-        memory = Memory(session_id=session_id)
-        raw_history_messages = await memory.aget_messages()
-        formatted_history = "\n".join(
-            f"{'User' if isinstance(m, HumanMessage) else 'Assistant'}: {m.content}"
-            for m in raw_history_messages[-10:]
-        )
-        general_chat_prompt = ChatPromptTemplate.from_template("""
+
+general_chat_prompt = ChatPromptTemplate.from_template("""
             You are the **General Chat Assistant for BabyNest**, an organization dedicated to supporting maternal health, baby care, and family wellness.
 
             Your personality blends **warmth, intelligence, and professionalism**.  
@@ -269,6 +366,7 @@ class PurposeModels():
             ---
             Previous conversation history is also provided as history to make your work easier and extremely efficient. Having the conversation history, be more intelligent,ask follow up questions, explain further and ensure you increase efficiency in all your operations.
             **[Relevant Knowledge Context (from RAG/VectorDB)]**
+            Passages are numbered with their source for reference only; never write the [n] numbers in your answer.
             {context}
 
             **[Conversation History]**
@@ -277,14 +375,140 @@ class PurposeModels():
             User: {user_query}  
             BabyNest Assistant:
             """)
+
+# One keep-alive pool shared by the Groq clients, so requests reuse warm TLS connections.
+groq_http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(60.0, connect=10.0),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=120)
+)
+
+
+def _create_router_llm():
+    from langchain_groq import ChatGroq
+
+    logger.info("Connecting to the router LLM...")
+    router_llm = ChatGroq(
+        model=os.getenv("ROUTER_MODEL"),
+        # model = "llama-3.3-70b-versatile",
+        api_key=os.getenv("GROQ_API_KEY"),
+        temperature=0.7,
+        http_async_client=groq_http_client
+    )
+    logger.info("Successfully connected to router llm")
+    return router_llm
+
+
+def _create_general_llm():
+    from langchain_groq import ChatGroq
+
+    logger.info("Connecting to general chat LLM")
+    return ChatGroq(
+        model=os.getenv("GENERAL_MODEL"),
+        api_key=os.getenv("GROQ_API_KEY"),
+        temperature=0.7,
+        streaming=True,
+        http_async_client=groq_http_client
+    )
+
+
+backends.register("router_llm", _create_router_llm)
+backends.register("general_llm", _create_general_llm)
+
+
+class AIModels():
+    """Hands out the LLM clients; they are created once, on first use, and reused across requests."""
+
+    async def router_model(self):
+        return await backends.aget("router_llm")
+
+    async def general_model(self):
+        return await backends.aget("general_llm")
+models = AIModels()
+
+GENERAL_CHAT_FAILURE = "General chat failed to return an answer"
+
+class PurposeModels():
+    def __init__(self):
+        self._router_chain = None
+        self._general_chain = None
+        self._router_llm = None
+        self._general_llm = None
+
+    async def router_chain(self):
+        router_llm = await models.router_model()
+        # Rebuilt only when the client is swapped (e.g. a benchmark stand-in).
+        if self._router_chain is None or router_llm is not self._router_llm:
+            self._router_chain = router_prompt | router_llm | StrOutputParser()
+            self._router_llm = router_llm
+        return self._router_chain
+
+    async def general_chain(self):
+        general_llm = await models.general_model()
+        if self._general_chain is None or general_llm is not self._general_llm:
+            self._general_chain = general_chat_prompt | general_llm | StrOutputParser()
+            self._general_llm = general_llm
+        return self._general_chain
+
+    async def router(self, query, embedding=None):
+        """
+        Returns "langchain" or "crewai". Keyword rules and the embedding classifier answer
+        most queries locally; the LLM is only asked when neither is confident. `embedding`
+        is the query embedding or the task computing it, awaited only if the rules do not decide.
+        """
+        route = keyword_route(query)
+        if route is not None:
+            logger.info(f"Routed by keyword rules: {route}")
+            return route
+
+        classifier = None
+        try:
+            if inspect.isawaitable(embedding):
+                embedding = await embedding
+            # Until the classifier is built (in the background) requests go to the LLM instead of waiting.
+            classifier = backends.peek("router_classifier", build=True) if embedding is not None else None
+            if classifier is not None:
+                route, margin = classifier.classify(embedding)
+                if route is not None:
+                    logger.info(f"Routed by the embedding classifier: {route} (margin {margin:.3f})")
+                    return route
+        except Exception as e:
+            logger.warning(f"Routing classifier unavailable, asking the LLM: {e}")
+
+        try:
+            router_chain = await self.router_chain()
+            with span("router"):
+                route = normalize_route(await router_chain.ainvoke({"input": query}))
+            logger.info(f"Successfully determined route: {route}")
+        except Exception as e:
+            logger.exception("Failed to authoritatively determine the route. Proceeding with langchain")
+            return "langchain"
+        if classifier is not None:
+            classifier.learn(route, embedding)
+        await asyncio.to_thread(routing_log.append, query, route)
+        return route
         
+    @staticmethod
+    def format_history(messages) -> str:
+        lines = []
+        for m in messages:
+            if isinstance(m, SystemMessage):
+                lines.append(f"Summary of earlier conversation:\n{m.content}")
+            else:
+                lines.append(f"{'User' if isinstance(m, HumanMessage) else 'Assistant'}: {m.content}")
+        return "\n".join(lines)
+
+    async def general_chat(self, query, session_id, history=None, context=None):
+        memory = Memory(session_id=session_id)
+        raw_history_messages = history if history is not None else await memory.aget_messages()
+        formatted_history = self.format_history(raw_history_messages)
+
         try:
-            general_llm = await models.general_model()
-            general_chain = general_chat_prompt | general_llm |StrOutputParser() 
-            document_context = retriever.get_documents(query=query)
-            output = await general_chain.ainvoke({"context":document_context,
-             "user_query": query ,
-             "history": formatted_history})
+            general_chain = await self.general_chain()
+            document_context = context if context is not None else await retriever.aget_documents(query=query)
+            with span("generation"):
+                output = await general_chain.ainvoke({"context":document_context,
+                 "user_query": query ,
+                 "history": formatted_history})
             
             await memory.aadd_messages([
                 HumanMessage(content=query),
@@ -295,6 +519,31 @@ class PurposeModels():
             return output
         except Exception as e:
             logger.exception("General chat: Failed")
-            return "General chat failed to return an answer"
+            return GENERAL_CHAT_FAILURE
 
-    
\ No newline at end of file
+    async def general_chat_stream(self, query, session_id, history=None, context=None):
+        """
+        Streaming variant of general_chat: yields answer tokens as the model produces them.
+        The exchange is saved to memory only once the whole answer has been streamed.
+        """
+        memory = Memory(session_id=session_id)
+        raw_history_messages = history if history is not None else await memory.aget_messages()
+        general_chain = await self.general_chain()
+        document_context = context if context is not None else await retriever.aget_documents(query=query)
+
+        parts = []
+        with span("generation"):
+            started = time.perf_counter()
+            async for token in general_chain.astream({"context": document_context,
+                 "user_query": query,
+                 "history": self.format_history(raw_history_messages)}):
+                if not parts:
+                    record("generation.first_token", time.perf_counter() - started)
+                parts.append(token)
+                yield token
+
+        await memory.aadd_messages([
+            HumanMessage(content=query),
+            AIMessage(content="".join(parts))
+        ])
+        logger.info("General chat stream: Successful")
@@ -0,0 +1,114 @@
+from langchain_core.documents import Document
+from dataclasses import dataclass, field
+import re
+import os
+
+CONTEXT_TOKEN_BUDGETS = {
+    "langchain": int(os.getenv("CONTEXT_TOKEN_BUDGET_LANGCHAIN", "900")),
+    "crewai": int(os.getenv("CONTEXT_TOKEN_BUDGET_CREWAI", "1200")),
+}
+DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+# The splitter overlaps neighbouring chunks by 50 characters, so any shared edge of at
+# least MIN_OVERLAP characters is treated as the seam between two adjacent chunks.
+MIN_OVERLAP = 20
+MAX_OVERLAP = 200
+
+_word_pattern = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class ContextChunk:
+    text: str
+    source: str
+    shingles: set = field(default_factory=set)
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = _word_pattern.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _containment(a: set, b: set) -> float:
+    """Share of the smaller shingle set found in the other, so a chunk copied inside a longer one counts too."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    for size in range(min(len(left), len(right), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _merge(chunk: ContextChunk, other: ContextChunk) -> bool:
+    """Joins two adjacent chunks of the same source in place; False if they do not touch."""
+    if chunk.source != other.source:
+        return False
+    if other.text in chunk.text:
+        return True
+    if chunk.text in other.text:
+        chunk.text = other.text
+    elif size := _overlap(chunk.text, other.text):
+        chunk.text = chunk.text + other.text[size:]
+    elif size := _overlap(other.text, chunk.text):
+        chunk.text = other.text + chunk.text[size:]
+    else:
+        return False
+    chunk.shingles = _shingles(chunk.text)
+    return True
+
+
+def _fit(text: str, tokens: int) -> str:
+    """Cuts text to roughly `tokens`, preferring to end on a sentence boundary."""
+    limit = tokens * 4
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    sentence_end = max(cut.rfind(". "), cut.rfind(".\n"))
+    return cut[:sentence_end + 1] if sentence_end > limit // 2 else cut.rstrip() + "..."
+
+
+def assemble_context(docs: list[Document], route: str = "langchain", budget: int | None = None) -> str:
+    """
+    Turns ranked chunks into the prompt context: adjacent chunks of one source are merged,
+    near-duplicates (chunks whose word shingles are mostly already kept) are dropped and
+    the rest is cut to the route's token budget. Each passage is numbered with its source
+    so the model can tell the passages apart.
+    """
+    if budget is None:
+        budget = CONTEXT_TOKEN_BUDGETS.get(route, CONTEXT_TOKEN_BUDGETS["langchain"])
+
+    chunks: list[ContextChunk] = []
+    for doc in docs:
+        text = doc.page_content.strip()
+        if not text:
+            continue
+        candidate = ContextChunk(text, str(doc.metadata.get("source", "knowledge base")), _shingles(text))
+        if any(_merge(chunk, candidate) for chunk in chunks):
+            continue
+        if any(_containment(chunk.shingles, candidate.shingles) >= DUPLICATE_THRESHOLD for chunk in chunks):
+            continue
+        chunks.append(candidate)
+
+    passages = []
+    remaining = budget
+    for chunk in chunks:
+        header = f"[{len(passages) + 1}] Source: {chunk.source}\n"
+        available = remaining - estimate_tokens(header)
+        if available < 50:
+            break
+        text = _fit(chunk.text, available)
+        passages.append(header + text)
+        remaining -= estimate_tokens(header + text)
+    return "\n\n".join(passages)
@@ -1,15 +1,27 @@
 from crewai import Agent, Crew, Process, Task, LLM
 from crewai.project import CrewBase, agent, crew, task
 from crewai.tools import tool
+from crewai.tasks.task_output import TaskOutput
+from pydantic import Field
+from typing import Any
 from dotenv import load_dotenv
 from .components import logger, retriever
+from .tracing import span
+from .run_retrieval import RunRetrieval
+from .finalizer import CREW_FINALIZER
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from functools import lru_cache
+import contextvars
+import threading
+import copy
+import yaml
 import os
 
 load_dotenv()
 
 
-@tool
-def internet_research_tool(query: str) -> str:
+def _internet_research(query: str, run: RunRetrieval | None = None) -> str:
     """
     Searches the internet for information based on a user's query.
     The 'query' must be a simple, single string (e.g., 'postpartum depression stories').
@@ -17,32 +29,68 @@ def internet_research_tool(query: str) -> str:
     """
     try:
         logger.info("Looking for internet information regarding your query")
-        result = retriever.web_search_tool(query=query)
+        with span("tool.internet_research"):
+            result = run.web(query) if run is not None else "\n\n".join(retriever.web_search_tool(query=query))
         logger.info("Web search tool successfully retrieved search results")
-        return "\n\n".join(result)
+        return result
     except Exception as e:
         logger.exception("Failed to search the internet for your query")
         return f"No information collected regarding {query}"
 
 
-@tool
-def rag_tool(query: str) -> str:
+def _rag(query: str, run: RunRetrieval | None = None) -> str:
     """
     Retrieves relevant documents from the vector database based on a user's query.
     The 'query' must be a simple, single string (e.g., 'community testimonials').
     Use this tool to get information from the internal knowledge base.
     """
     try:
-        result = retriever.get_documents(query=query)
+        with span("tool.rag"):
+            result = run.rag(query) if run is not None else retriever.get_documents(query=query, route="crewai")
         return result
     except Exception as e:
         logger.exception("Failed to search the vector db")
         return "No relevant documents found"
 
-   
+
+def make_tools(run: RunRetrieval | None = None) -> tuple:
+    """Builds the retrieval tools; with a run they share its memoized results."""
+    def internet_research_tool(query: str) -> str:
+        return _internet_research(query, run)
+
+    def rag_tool(query: str) -> str:
+        return _rag(query, run)
+
+    # The helpers' docstrings are the tool descriptions the agents see.
+    internet_research_tool.__doc__ = _internet_research.__doc__
+    rag_tool.__doc__ = _rag.__doc__
+    return tool(internet_research_tool), tool(rag_tool)
+
+
+internet_research_tool, rag_tool = make_tools()
+
+
+def bind_run_tools(crew_instance: Crew, run: RunRetrieval) -> None:
+    """Swaps the agents' and tasks' retrieval tools for copies bound to this run."""
+    bound = {t.name: t for t in make_tools(run)}
+    for crew_agent in crew_instance.agents:
+        crew_agent.tools = [bound.get(t.name, t) for t in crew_agent.tools or []]
+    # Tasks copy their agent's tools when they are built and the crew prefers them.
+    for crew_task in crew_instance.tasks:
+        if crew_task.tools:
+            crew_task.tools = [bound.get(t.name, t) for t in crew_task.tools]
+
+
+CREW_POOL_SIZE = int(os.getenv("CREW_POOL_SIZE", "2"))
+# sequential: the main agent delegates one hop at a time (the original flow).
+# parallel: the main agent only picks the research branches, which then run concurrently.
+CREW_MODE = os.getenv("CREW_MODE", "sequential").lower()
+
+
+@lru_cache(maxsize=1)
 def get_llm():
+    """Returns the Gemini LLM shared by every agent of every crew."""
     try:
-        load_dotenv()
         return LLM(
             model="gemini/gemini-2.5-flash",
             api_key=os.getenv("GOOGLE_API_KEY"),
@@ -54,25 +102,73 @@ def get_llm():
         raise ValueError(f"Failed to connect to Gemini")
 
 
-@CrewBase
-class Babynest:
-    """Babynest crew"""
+@lru_cache(maxsize=1)
+def load_config() -> tuple[dict, dict]:
+    """Parses agents.yaml and tasks.yaml once per process."""
+    config_dir = os.path.join(os.path.dirname(__file__), "config")
+    try:
+        with open(os.path.join(config_dir, "agents.yaml"), "r") as f:
+            agents_config = yaml.safe_load(f)
+        with open(os.path.join(config_dir, "tasks.yaml"), "r") as f:
+            tasks_config = yaml.safe_load(f)
+        logger.info("Configuration files loaded successfully")
+        return agents_config, tasks_config
+    except Exception as e:
+        logger.warning("Failed to load config files: %s", e)
+        return {}, {}
+
+
+def branch_selected(branch: str, plan_task: Task | None) -> bool:
+    """Reads the branch plan ("research", "community" or "both"); an unclear plan runs every branch."""
+    if plan_task is None or plan_task.output is None:
+        return True
+    plan = plan_task.output.raw.lower()
+    if "both" in plan:
+        return True
+    mentioned = [name for name in ("research", "community") if name in plan]
+    return not mentioned or branch in mentioned
 
-    def __init__(self):
-        import os, yaml
 
-        base_dir = os.path.dirname(__file__)
-        config_dir = os.path.join(base_dir, "config")
+class BranchTask(Task):
+    """
+    A research branch of the parallel crew. It runs in its own thread next to the other branch
+    and is skipped without any model call when the branch plan leaves it out.
+    """
 
+    branch: str = Field(default="")
+    plan_task: Any = Field(default=None, exclude=True)
+
+    def _run_branch(self, agent, context, tools, future: Future) -> None:
         try:
-            with open(os.path.join(config_dir, "agents.yaml"), "r") as f:
-                self.agents_config = yaml.safe_load(f)
-            with open(os.path.join(config_dir, "tasks.yaml"), "r") as f:
-                self.tasks_config = yaml.safe_load(f)
-            logger.info("Configuration files loaded successfully")
+            future.set_result(self.execute_sync(agent=agent, context=context, tools=tools))
         except Exception as e:
-            logger.warning("Failed to load config files: %s", e)
-            self.agents_config, self.tasks_config = {}, {}
+            future.set_exception(e)
+
+    def execute_async(self, agent=None, context=None, tools=None) -> Future:
+        future = Future()
+        if not branch_selected(self.branch, self.plan_task):
+            logger.info(f"Skipping the {self.branch} branch")
+            future.set_result(TaskOutput(
+                description=self.description,
+                raw=f"The {self.branch} branch was not needed for this query.",
+                agent=agent.role if agent is not None else ""
+            ))
+            return future
+        # Run in a copy of the caller's context so tool spans still reach the request trace.
+        ctx = contextvars.copy_context()
+        threading.Thread(daemon=True, target=ctx.run, args=(self._run_branch, agent, context, tools, future)).start()
+        return future
+
+
+@CrewBase
+class Babynest:
+    """Babynest crew"""
+
+    def __init__(self):
+        agents_config, tasks_config = load_config()
+        # Each crew gets its own copy so CrewBase can never leak changes between requests.
+        self.agents_config = copy.deepcopy(agents_config)
+        self.tasks_config = copy.deepcopy(tasks_config)
 
     @agent
     def main_agent(self) -> Agent:
@@ -80,6 +176,8 @@ class Babynest:
             config=self.agents_config.get('main_agent', {}),
             verbose=True,
             llm=get_llm(),
+            # In parallel mode the branches are wired by the crew, not delegated.
+            allow_delegation=CREW_MODE != "parallel",
             max_iter=2
         )
 
@@ -129,8 +227,23 @@ class Babynest:
             agent=self.main_agent() 
         )
 
+    @task
+    def branch_selection_task(self) -> Task:
+        return Task(
+            config=self.tasks_config.get('branch_selection_task', {}),
+            agent=self.main_agent()
+        )
+
     @task
     def maternal_health_task(self) -> Task:
+        if CREW_MODE == "parallel":
+            return BranchTask(
+                config=self.tasks_config.get('maternal_health_researcher_task', {}),
+                agent=self.maternal_health_researcher(),
+                async_execution=True,
+                branch="research",
+                plan_task=self.branch_selection_task()
+            )
         return Task(
             config=self.tasks_config.get('maternal_health_researcher_task', {}),
             agent=self.maternal_health_researcher() # This needs a user_query variable
@@ -138,14 +251,27 @@ class Babynest:
     
     @task
     def personalized_health_communicator_task(self) -> Task:
+        if CREW_MODE == "parallel":
+            # Join step: waits for both branches and gets whichever outputs they produced.
+            context = [self.maternal_health_task(), self.community_testimonials()]
+        else:
+            context = [self.routing_task()]
         return Task(
             config=self.tasks_config.get('personalized_health_communicator_task', {}),
             agent=self.personalized_health_communicator(),
-            context=[self.routing_task()]
+            context=context
         )
 
     @task
     def community_testimonials(self) -> Task:
+        if CREW_MODE == "parallel":
+            return BranchTask(
+                config=self.tasks_config.get('community_testimonials_task', {}),
+                agent=self.community_testimonials_researcher(),
+                async_execution=True,
+                branch="community",
+                plan_task=self.branch_selection_task()
+            )
         return Task(
             config=self.tasks_config.get('community_testimonials_task', {}),
             agent=self.community_testimonials_researcher(),
@@ -159,25 +285,110 @@ class Babynest:
             context=[self.personalized_health_communicator_task()]
         )
 
-    @crew
-    def crew(self) -> Crew:
-        """Creates the Babynest crew with the new sequential process."""
-        return Crew(
-            agents=[
-                self.main_agent(),
-                self.maternal_health_researcher(),
-                self.community_testimonials_researcher(),
-                self.personalized_health_communicator(),
-                self.final_response_synthesizer()
-            ],
-            tasks=[
+    def final_response_fallback_task(self) -> Task:
+        # Not part of the crew graph: it only runs on a draft the local finalizer rejected.
+        return Task(
+            config=self.tasks_config.get('final_response_fallback_task', {}),
+            agent=self.final_response_synthesizer()
+        )
+
+    def tasks_for_mode(self) -> list[Task]:
+        if CREW_MODE == "parallel":
+            tasks = [
+                self.branch_selection_task(),
+                self.maternal_health_task(),
+                self.community_testimonials(),
+                self.personalized_health_communicator_task(),
+            ]
+        else:
+            tasks = [
                 self.routing_task(),
                 # self.maternal_health_task(),
                 self.personalized_health_communicator_task(),
                 # self.community_testimonials(),
-                self.final_response_synthesizer_task(),
-            ],
+            ]
+        if CREW_FINALIZER == "llm":
+            tasks.append(self.final_response_synthesizer_task())
+        return tasks
+
+    @crew
+    def crew(self) -> Crew:
+        """Creates the Babynest crew; CREW_MODE picks the sequential or the parallel task graph."""
+        agents = [
+            self.main_agent(),
+            self.maternal_health_researcher(),
+            self.community_testimonials_researcher(),
+            self.personalized_health_communicator(),
+        ]
+        if CREW_FINALIZER == "llm":
+            agents.append(self.final_response_synthesizer())
+        return Crew(
+            agents=agents,
+            tasks=self.tasks_for_mode(),
             process=Process.sequential,
             verbose=True,
         )
-    
+
+    def synthesizer_crew(self) -> Crew:
+        """A one-task crew that has the synthesizer rewrite a draft passed in as `draft`."""
+        return Crew(
+            agents=[self.final_response_synthesizer()],
+            tasks=[self.final_response_fallback_task()],
+            process=Process.sequential,
+            verbose=True,
+        )
+
+
+class CrewPool:
+    """
+    Keeps a few ready-built Babynest crews so a request only pays for model calls.
+    A crew carries task outputs and agent state after kickoff, so it is never reused:
+    every acquire hands out a fresh crew and a replacement is built in the background.
+    """
+
+    def __init__(self, size: int = CREW_POOL_SIZE):
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crew-pool")
+
+    def _build(self) -> Crew:
+        return Babynest().crew()
+
+    def _refill(self) -> None:
+        while True:
+            with self._lock:
+                if len(self._idle) >= self.size:
+                    return
+            try:
+                crew_instance = self._build()
+            except Exception as e:
+                logger.exception(f"Failed to prebuild a crew: {e}")
+                return
+            with self._lock:
+                self._idle.append(crew_instance)
+
+    def start(self) -> None:
+        """Prebuilds the pool in the background."""
+        self._builder.submit(self._refill)
+
+    @contextmanager
+    def acquire(self, run: RunRetrieval | None = None):
+        with self._lock:
+            crew_instance = self._idle.pop() if self._idle else None
+        # Start building the replacement while this request runs.
+        self._builder.submit(self._refill)
+        if crew_instance is None:
+            logger.info("Crew pool empty, building a crew on demand")
+            crew_instance = self._build()
+        if run is not None:
+            bind_run_tools(crew_instance, run)
+        yield crew_instance
+
+    def synthesize(self, draft: str, user_query: str) -> str:
+        """Has the LLM synthesizer rewrite a draft the local finalizer could not fix."""
+        # Rare enough that it is built on demand rather than pooled.
+        return Babynest().synthesizer_crew().kickoff(inputs={"user_query": user_query, "draft": draft}).raw
+
+
+crew_pool = CrewPool()
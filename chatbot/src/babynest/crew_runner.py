@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor
+from .tracing import span, record
+from .run_retrieval import RunRetrieval
+from .finalizer import CREW_FINALIZER, finalize
+from .components import logger
+from .backends import backends
+import contextvars
+import threading
+import asyncio
+import time
+import re
+import os
+
+CREW_MAX_WORKERS = int(os.getenv("CREW_MAX_WORKERS", "2"))
+CREW_MAX_QUEUE = int(os.getenv("CREW_MAX_QUEUE", "4"))
+CREW_TIMEOUT = float(os.getenv("CREW_TIMEOUT", "120"))
+
+
+def _create_crew_pool():
+    # Importing crew.py pulls in all of CrewAI, so it only happens on first use or warm-up.
+    from .crew import crew_pool
+
+    crew_pool.start()
+    return crew_pool
+
+
+backends.register("crew_pool", _create_crew_pool, required=False)
+
+
+class CrewBusyError(Exception):
+    """Raised when every crew worker is busy and the wait queue is full."""
+
+
+class CrewRunner:
+    """
+    Runs crew kickoffs on a dedicated, size-limited thread pool so they never block the event loop.
+    At most `workers` crews run at once and `max_queue` more may wait; anything beyond that is
+    rejected immediately. A timed-out crew keeps its slot until its thread actually finishes,
+    so a stuck model call cannot let more work pile up behind it.
+    """
+
+    def __init__(self, workers: int = CREW_MAX_WORKERS, max_queue: int = CREW_MAX_QUEUE, timeout: float = CREW_TIMEOUT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crew")
+        self.capacity = workers + max_queue
+        self.timeout = timeout
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def _finalize(self, pool, output, user_query: str):
+        """
+        Finalizes the communicator's draft in code. Only a draft that fails validation goes to
+        the LLM synthesizer, and if that fails too the mechanically cleaned draft is kept.
+        """
+        with span("crew.finalize"):
+            result = finalize(output.raw)
+        if not result.valid:
+            logger.warning(f"Crew draft failed validation ({', '.join(result.issues)}), falling back to the synthesizer")
+            try:
+                with span("crew.synthesizer"):
+                    synthesized = finalize(pool.synthesize(output.raw, user_query))
+                if synthesized.valid:
+                    result = synthesized
+            except Exception as e:
+                logger.error(f"Synthesizer fallback failed, keeping the local draft: {e}")
+        output.raw = result.text
+        return output
+
+    def _kickoff(self, inputs: dict, run: RunRetrieval, on_event=None):
+        pool = backends.get("crew_pool")
+        with pool.acquire(run) as crew_instance:
+            last_completed = time.perf_counter()
+
+            def task_completed(output):
+                # Sequential tasks finish one after another, so the time since the previous
+                # completion is the time the agent spent on this task.
+                nonlocal last_completed
+                now = time.perf_counter()
+                agent = str(getattr(output, "agent", "") or "")
+                record(f"crew.agent.{re.sub(r'[^a-z0-9]+', '_', agent.lower()).strip('_') or 'unknown'}", now - last_completed)
+                last_completed = now
+                if on_event is not None:
+                    on_event({
+                        "stage": "task_completed",
+                        "agent": agent,
+                        "summary": getattr(output, "summary", None),
+                    })
+
+            if on_event is not None:
+                on_event({"stage": "started"})
+            crew_instance.task_callback = task_completed
+            output = crew_instance.kickoff(inputs=inputs)
+        if CREW_FINALIZER == "local":
+            output = self._finalize(pool, output, inputs["user_query"])
+        return output
+
+    async def run(self, user_query: str, on_event=None, timeout: float | None = None, embedding=None):
+        """
+        Runs one crew for the query. `on_event` is called from the worker thread with
+        progress dictionaries, so it must be thread safe. `timeout` overrides CREW_TIMEOUT.
+        Knowledge base and web results for the query are fetched once before kickoff
+        (reusing `embedding` when given) and shared by every agent of the run; the timeout
+        covers this prefetch and the crew together.
+        """
+        timeout = timeout or self.timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                raise CrewBusyError(f"{self._in_flight} crew runs already in flight")
+            self._in_flight += 1
+        try:
+            run = RunRetrieval(user_query)
+            with span("crew.prefetch"):
+                prefetched_context = await asyncio.wait_for(run.prefetch(embedding), timeout=timeout)
+            inputs = {"user_query": user_query, "prefetched_context": prefetched_context}
+            # The worker thread runs in a copy of this context so its spans land in the request trace.
+            future = self.executor.submit(contextvars.copy_context().run, self._kickoff, inputs, run, on_event)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            with span("crew"):
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout=max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            logger.error(f"Crew run exceeded {timeout}s")
+            raise
+
+
+crew_runner = CrewRunner()
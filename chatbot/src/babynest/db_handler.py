@@ -1,11 +1,22 @@
-from langchain_community.document_loaders import DirectoryLoader, PDFPlumberLoader, WebBaseLoader, TextLoader
+from langchain_community.document_loaders import PDFPlumberLoader, WebBaseLoader, TextLoader
+from langchain_community.document_loaders.web_base import default_header_template
 from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_cohere import CohereEmbeddings
+import chromadb
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
 from pathlib import Path
-from .components import logger, knowledge_directory, db_directory, embeddings
+from .components import logger, knowledge_directory, db_directory, lexical_index_directory, get_embeddings
+from .lexical_index import BM25Index
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+import requests
+import multiprocessing
+import argparse
+import hashlib
+import random
+import threading
+import json
+import time
 import os
 
 load_dotenv()
@@ -33,49 +44,348 @@ resources_links = [
     "https://www.thebump.com/pregnancy-week-by-week"
 ]
 
-web_loader = WebBaseLoader(resources_links)
-# PDF files
-pdf_loaders = DirectoryLoader(
-    str(knowledge_directory),
-    loader_cls=PDFPlumberLoader,
-    glob="*.pdf"
-)
-# Text files
-text_loader = DirectoryLoader(
-    str(knowledge_directory),
-    loader_cls=TextLoader,
-    glob="*.txt"
-)
-try:
-    web_data = web_loader.load()
-    pdf_data = pdf_loaders.load()
-    text_data = text_loader.load()
-    logger.info("Successfully loaded stored data...")
-except Exception as e:
-    logger.exception("Failed to load all the data sources")
-    raise 
-
-
-
-try:
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    pdf_chunks = text_splitter.split_documents(pdf_data)
-    web_chunks = text_splitter.split_documents(web_data)
-    text_chunks = text_splitter.split_documents(text_data)
-    chunks = pdf_chunks + web_chunks + text_chunks
-    logger.info("Successfully chunked the text data")
-except Exception as e:
-    logger.exception("Failed to chunk the data.")
-
-#Populating the database
-try:
-    vectordb = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=db_directory
+manifest_path = Path(db_directory)/"ingest_manifest.json"
+# Chroma's default collection, which the app's vector store reads.
+collection_name = "langchain"
+MANIFEST_VERSION = 1
+
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+
+# Cohere accepts at most 96 texts per embed call.
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "96"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "6"))
+LOAD_WEB_WORKERS = int(os.getenv("LOAD_WEB_WORKERS", "8"))
+LOAD_PDF_WORKERS = int(os.getenv("LOAD_PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+LOAD_TIMEOUT = float(os.getenv("LOAD_TIMEOUT", "30"))
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_documents(documents) -> str:
+    """Hashes the parsed text of a source, used for sources we cannot hash before loading (web pages)."""
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def chunk_ids(source: str, chunks) -> list[str]:
+    """
+    Builds stable chunk IDs from the source and the chunk text.
+    Re-running ingestion on unchanged content produces the same IDs, so rows are
+    replaced instead of duplicated and unchanged chunks never need re-embedding.
+    """
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        content_hash = hash_bytes(chunk.page_content.encode("utf-8"))
+        occurrence = seen.get(content_hash, 0)
+        seen[content_hash] = occurrence + 1
+        ids.append(hash_bytes(f"{source}\x00{content_hash}\x00{occurrence}".encode("utf-8"))[:40])
+    return ids
+
+
+def load_manifest() -> dict | None:
+    if not manifest_path.exists():
+        return None
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        if manifest.get("version") != MANIFEST_VERSION:
+            logger.warning("Ingest manifest version mismatch, a full rebuild will be performed")
+            return None
+        return manifest
+    except Exception as e:
+        logger.warning(f"Failed to read the ingest manifest, a full rebuild will be performed: {e}")
+        return None
+
+
+def save_manifest(manifest: dict) -> None:
+    """Writes the manifest atomically so an interrupted run never leaves it half written."""
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp_path, manifest_path)
+
+
+class LoadReport:
+    """Collects which sources were seen and which failed to load during one ingestion pass."""
+
+    def __init__(self):
+        self.seen = set()
+        self.failures = {}
+
+
+def _parse_pdf(path: str):
+    """Runs in a worker process: pdfplumber parsing is CPU bound and holds the GIL."""
+    return PDFPlumberLoader(path).load()
+
+
+def _load_text(path: str):
+    return TextLoader(path).load()
+
+
+def _load_web(url: str, session):
+    # Error pages must fail the source rather than be ingested as content.
+    return WebBaseLoader(url, session=session, raise_for_status=True, requests_kwargs={"timeout": LOAD_TIMEOUT}).load()
+
+
+def _web_session() -> requests.Session:
+    session = requests.Session()
+    # WebBaseLoader only sets its default headers on sessions it creates itself.
+    session.headers.update(default_header_template)
+    adapter = HTTPAdapter(pool_connections=LOAD_WEB_WORKERS, pool_maxsize=LOAD_WEB_WORKERS, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def load_sources(manifest: dict, report: LoadReport):
+    """
+    Loads every changed knowledge source concurrently and yields (source, kind, content_hash, documents)
+    as soon as each one is ready: web pages on a pooled HTTP session in threads, PDFs in a process pool.
+    Files whose bytes match the manifest are skipped before parsing; web pages can only be compared
+    after they are fetched. A failing source is recorded in the report instead of aborting the run.
+    """
+    known = manifest["sources"]
+    session = _web_session()
+    web_pool = ThreadPoolExecutor(max_workers=LOAD_WEB_WORKERS, thread_name_prefix="ingest-web")
+    # Spawned, not forked: the web threads are already running and a fork could copy a held lock.
+    pdf_pool = ProcessPoolExecutor(max_workers=LOAD_PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    pending = {}
+    try:
+        for url in dict.fromkeys(resources_links):
+            report.seen.add(url)
+            pending[web_pool.submit(_load_web, url, session)] = (url, "web", None)
+
+        for kind, pattern, pool, parse in (("pdf", "*.pdf", pdf_pool, _parse_pdf), ("text", "*.txt", web_pool, _load_text)):
+            for path in sorted(Path(knowledge_directory).glob(pattern)):
+                source = str(path)
+                report.seen.add(source)
+                try:
+                    file_hash = hash_bytes(path.read_bytes())
+                except Exception as e:
+                    logger.error(f"Failed to read {source}: {e}")
+                    report.failures[source] = str(e)
+                    continue
+                if file_hash == known.get(source, {}).get("hash"):
+                    logger.info(f"Skipping unchanged source {source}")
+                    continue
+                pending[pool.submit(parse, source)] = (source, kind, file_hash)
+
+        for future in as_completed(pending):
+            source, kind, content_hash = pending[future]
+            try:
+                documents = future.result()
+            except Exception as e:
+                logger.error(f"Failed to load {source}: {e}")
+                report.failures[source] = str(e)
+                continue
+            content_hash = content_hash or hash_documents(documents)
+            if content_hash == known.get(source, {}).get("hash"):
+                logger.info(f"Skipping unchanged source {source}")
+                continue
+            yield source, kind, content_hash, documents
+    finally:
+        web_pool.shutdown(wait=False, cancel_futures=True)
+        pdf_pool.shutdown(wait=False, cancel_futures=True)
+        session.close()
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for rate limiting (429) and temporary unavailability, which are worth backing off for."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status in (429, 503):
+        return True
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message or "too many requests" in message
+
+
+class BatchEmbeddingWriter:
+    """
+    Embeds chunks in fixed-size batches on a bounded worker pool and upserts every batch,
+    with its precomputed vectors, into the Chroma collection as soon as it is embedded.
+    At most two batches per worker are queued; submit() blocks beyond that, which keeps
+    memory flat and stops the loaders from running far ahead of a rate-limited embedder.
+    """
+
+    def __init__(self, vectordb, collection, batch_size: int = INGEST_BATCH_SIZE, workers: int = INGEST_WORKERS, max_retries: int = INGEST_MAX_RETRIES):
+        self.vectordb = vectordb
+        self.collection = collection
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-embed")
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.write_lock = threading.Lock()
+        self.futures = []
+        self.failures = []
+
+    def _embed_with_backoff(self, texts: list[str]) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return get_embeddings().embed_documents(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                logger.warning(f"Embedding batch rate limited, retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+
+    def _embed_and_write(self, chunks, ids: list[str]) -> None:
+        texts = [chunk.page_content for chunk in chunks]
+        vectors = self._embed_with_backoff(texts)
+        with self.write_lock:
+            # Upserting by ID means a retried batch replaces its rows instead of duplicating them.
+            self.collection.upsert(
+                ids=ids,
+                embeddings=vectors,
+                documents=texts,
+                metadatas=[chunk.metadata for chunk in chunks]
+            )
+
+    def delete(self, ids: list[str]) -> None:
+        if ids:
+            with self.write_lock:
+                self.vectordb.delete(ids=ids)
+
+    def submit(self, source: str, chunks, ids: list[str], on_done=None) -> None:
+        """Queues the chunks of one source; on_done runs once every batch of the source is written."""
+        batches = [
+            (chunks[start:start + self.batch_size], ids[start:start + self.batch_size])
+            for start in range(0, len(chunks), self.batch_size)
+        ]
+        if not batches:
+            if on_done:
+                on_done()
+            return
+
+        state = {"pending": len(batches), "failed": False}
+        state_lock = threading.Lock()
+
+        def finished(future):
+            self.slots.release()
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Failed to embed a batch of {source}: {error}")
+            with state_lock:
+                state["pending"] -= 1
+                if error is not None and not state["failed"]:
+                    state["failed"] = True
+                    self.failures.append(source)
+                done = state["pending"] == 0 and not state["failed"]
+            if done and on_done:
+                on_done()
+
+        for batch_chunks, batch_ids in batches:
+            self.slots.acquire()
+            future = self.executor.submit(self._embed_and_write, batch_chunks, batch_ids)
+            future.add_done_callback(finished)
+            self.futures.append(future)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+def ingest_source(writer: BatchEmbeddingWriter, manifest: dict, manifest_lock, source: str, kind: str, content_hash: str, documents) -> int:
+    """
+    Re-chunks one changed source, queues only chunks whose IDs are new and deletes the stale ones.
+    Stale chunks are deleted and the manifest entry written only after all batches of the source
+    are stored, so a failed or interrupted run keeps the old chunks and the source is retried next time.
+    """
+    previous = manifest["sources"].get(source, {})
+    old_ids = set(previous.get("chunk_ids", []))
+
+    chunks = text_splitter.split_documents(documents)
+    ids = chunk_ids(source, chunks)
+
+    stale_ids = list(old_ids.difference(ids))
+
+    new_chunks, new_ids = [], []
+    for chunk, chunk_id in zip(chunks, ids):
+        if chunk_id not in old_ids:
+            new_chunks.append(chunk)
+            new_ids.append(chunk_id)
+
+    def record():
+        writer.delete(stale_ids)
+        with manifest_lock:
+            manifest["sources"][source] = {"kind": kind, "hash": content_hash, "chunk_ids": ids}
+            save_manifest(manifest)
+        logger.info(f"Ingested {source}: {len(new_ids)} new, {len(stale_ids)} removed, {len(ids) - len(new_ids)} unchanged chunks")
+
+    writer.submit(source, new_chunks, new_ids, on_done=record)
+    return len(new_ids)
+
+
+def build_lexical_index(vectordb) -> None:
+    """Rebuilds the BM25 index from every chunk currently in Chroma, so both indexes share chunk IDs."""
+    stored = vectordb.get(include=["documents"])
+    BM25Index.build(lexical_index_directory, stored["ids"], stored["documents"])
+
+
+def run_ingestion(full_rebuild: bool = False) -> bool:
+    """Runs one ingestion pass and returns False if any source failed to load or embed."""
+    # One client for the LangChain wrapper and the writer, which upserts precomputed vectors directly.
+    client = chromadb.PersistentClient(path=str(db_directory))
+    vectordb = Chroma(
+        client=client,
+        collection_name=collection_name,
+        embedding_function=get_embeddings()
     )
-    logger.info("Successfully populated the Chroma database!")
-except Exception as e:
-    logger.exception("Failed to populate the Chroma database!")
+
+    manifest = None if full_rebuild else load_manifest()
+    if manifest is None:
+        # Without a manifest we cannot tell which rows belong to which source,
+        # so start from an empty collection to drop duplicates from older runs.
+        logger.info("No usable ingest manifest, rebuilding the Chroma collection from scratch")
+        vectordb.reset_collection()
+        manifest = {"version": MANIFEST_VERSION, "sources": {}}
+    manifest_lock = threading.Lock()
+    # Looked up after a possible reset, which replaces the collection.
+    writer = BatchEmbeddingWriter(vectordb, client.get_collection(collection_name))
+
+    report = LoadReport()
+    queued = 0
+    try:
+        for source, kind, content_hash, documents in load_sources(manifest, report):
+            queued += ingest_source(writer, manifest, manifest_lock, source, kind, content_hash, documents)
+    finally:
+        writer.close()
+
+    # Sources that failed to load count as seen, so a flaky URL never deletes its previous chunks.
+    removed_sources = set(manifest["sources"]).difference(report.seen)
+    for source in removed_sources:
+        stale_ids = manifest["sources"].pop(source).get("chunk_ids", [])
+        writer.delete(stale_ids)
+        logger.info(f"Removed {len(stale_ids)} chunks for deleted source {source}")
+    save_manifest(manifest)
+    build_lexical_index(vectordb)
+
+    if report.failures:
+        logger.error(f"Failed to load {len(report.failures)} sources, their previous chunks were kept: {sorted(report.failures)}")
+    if writer.failures:
+        logger.error(f"Failed to embed {len(writer.failures)} sources, they will be retried on the next run: {writer.failures}")
+    if report.failures or writer.failures:
+        return False
+    logger.info(f"Successfully populated the Chroma database! Embedded {queued} chunks, removed {len(removed_sources)} sources.")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest the BabyNest knowledge base into Chroma.")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild every source.")
+    args = parser.parse_args()
+    try:
+        succeeded = run_ingestion(full_rebuild=args.full)
+    except Exception as e:
+        logger.exception("Failed to populate the Chroma database!")
+        raise
+    if not succeeded:
+        raise SystemExit(1)
 
 
+if __name__ == "__main__":
+    main()
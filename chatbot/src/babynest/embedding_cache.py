@@ -0,0 +1,152 @@
+from langchain_core.embeddings import Embeddings
+from collections import OrderedDict
+from array import array
+from pathlib import Path
+import threading
+import asyncio
+import hashlib
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with an in-memory LRU in front of an on-disk SQLite store.
+    Entries are keyed by model name, input type (document/query) and a hash of the text,
+    so the same text embedded for retrieval and for indexing never collide.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache_path: Path, max_memory_items: int = 4096):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        try:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(cache_path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._db.commit()
+        except Exception as e:
+            logger.warning(f"Embedding cache disk store unavailable, using memory only: {e}")
+            self._db = None
+
+    def _key(self, kind: str, text: str) -> str:
+        if kind == "query":
+            # Queries differing only in case or spacing embed to practically the same vector.
+            text = " ".join(text.lower().split())
+        return hashlib.sha256(f"{self.model_name}\x00{kind}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: list[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys: list[str]) -> dict[str, list[float]]:
+        """Returns cached vectors for the keys found in memory or on disk."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            missing = [key for key in keys if key not in found]
+            if missing and self._db is not None:
+                try:
+                    for start in range(0, len(missing), 500):
+                        batch = missing[start:start + 500]
+                        placeholders = ",".join("?" * len(batch))
+                        rows = self._db.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                        ).fetchall()
+                        for key, blob in rows:
+                            vector = array("f", blob).tolist()
+                            found[key] = vector
+                            self._remember(key, vector)
+                except Exception as e:
+                    logger.warning(f"Failed to read from the embedding cache: {e}")
+        return found
+
+    def _store(self, items: dict[str, list[float]]) -> None:
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            if self._db is not None:
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                        [(key, array("f", vector).tobytes()) for key, vector in items.items()]
+                    )
+                    self._db.commit()
+                except Exception as e:
+                    logger.warning(f"Failed to write to the embedding cache: {e}")
+
+    def _split(self, kind: str, texts: list[str]):
+        keys = [self._key(kind, text) for text in texts]
+        found = self._lookup(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        return keys, found, missing
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, missing = self._split("document", texts)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        keys, found, missing = self._split("query", [text])
+        if missing:
+            vector = self.underlying.embed_query(text)
+            self._store({keys[0]: vector})
+            return vector
+        return found[keys[0]]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Batched embed_query: the vectors are in the query space and share its cache entries.
+        Models with an `input_type` (Cohere) get one call per batch, others one call per text.
+        """
+        keys, found, missing = self._split("query", texts)
+        if missing:
+            if hasattr(self.underlying, "embed"):
+                vectors = self.underlying.embed(list(missing.values()), input_type="search_query")
+            else:
+                vectors = [self.underlying.embed_query(text) for text in missing.values()]
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, missing = await asyncio.to_thread(self._split, "document", texts)
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            await asyncio.to_thread(self._store, computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = self._key("query", text)
+        with self._lock:
+            if key in self._memory:
+                # Memory hits are answered without leaving the event loop.
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        keys, found, missing = await asyncio.to_thread(self._split, "query", [text])
+        if missing:
+            vector = await self.underlying.aembed_query(text)
+            await asyncio.to_thread(self._store, {key: vector})
+            return vector
+        return found[key]
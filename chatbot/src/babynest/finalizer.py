@@ -0,0 +1,114 @@
+from dataclasses import dataclass, field
+import re
+import os
+
+# local: the crew ends at the communicator and its draft is finalized in code.
+# llm: the final_response_synthesizer task runs as the last crew step (the original flow).
+CREW_FINALIZER = os.getenv("CREW_FINALIZER", "local").lower()
+FINAL_MAX_LENGTH = int(os.getenv("FINAL_MAX_LENGTH", "1200"))
+FINAL_MIN_LENGTH = int(os.getenv("FINAL_MIN_LENGTH", "80"))
+DISCLAIMER = "_Please check with your doctor or midwife about anything specific to your own health._"
+
+_professional_pattern = re.compile(
+    r"\b(doctor|physician|midwife|midwives|nurse|obstetrician|ob-?gyn|gp|healthcare (provider|professional)|"
+    r"health ?care provider|medical professional|clinician|pediatrician|paediatrician)s?\b",
+    re.IGNORECASE,
+)
+# Scaffolding an agent sometimes leaves in its answer.
+_agent_prefix_pattern = re.compile(r"^\s*(final answer|answer|response)\s*:\s*", re.IGNORECASE)
+_agent_trace_pattern = re.compile(r"^\s*(thought|action|action input|observation)\s*:", re.IGNORECASE | re.MULTILINE)
+_fence_pattern = re.compile(r"^```[a-z]*\s*\n(.*?)\n```\s*$", re.DOTALL | re.IGNORECASE)
+_bullet_pattern = re.compile(r"^(\s*)[*•+]\s+", re.MULTILINE)
+_heading_pattern = re.compile(r"^(#{1,6})([^#\s])", re.MULTILINE)
+_sentence_end_pattern = re.compile(r"(?<=[.!?])\s+")
+
+
+@dataclass
+class FinalizedResponse:
+    text: str
+    issues: list[str] = field(default_factory=list)
+
+    @property
+    def valid(self) -> bool:
+        return not self.issues
+
+
+def _normalize_markdown(text: str) -> str:
+    text = text.replace("\r\n", "\n").strip()
+    fenced = _fence_pattern.match(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    text = _agent_prefix_pattern.sub("", text, count=1)
+    text = _bullet_pattern.sub(r"\1- ", text)
+    text = _heading_pattern.sub(r"\1 \2", text)
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def _key(text: str) -> str:
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def _deduplicate(text: str) -> str:
+    """Drops repeated paragraphs, list items and sentences, keeping the first occurrence."""
+    seen = set()
+    blocks = []
+    for block in text.split("\n\n"):
+        lines = []
+        block_seen = set()
+        for line in block.split("\n"):
+            sentences = []
+            for sentence in _sentence_end_pattern.split(line):
+                key = _key(sentence)
+                # Within a paragraph every repeat goes; across paragraphs headings and very
+                # short fragments ("Yes.") may legitimately repeat.
+                if key and key in block_seen or len(key) > 20 and key in seen:
+                    continue
+                block_seen.add(key)
+                seen.add(key)
+                sentences.append(sentence)
+            if sentences:
+                lines.append(" ".join(sentences))
+        if any(_key(line) for line in lines):
+            blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def _truncate(text: str, limit: int) -> str:
+    """Cuts at the last paragraph or sentence boundary that fits, never mid-word."""
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    for boundary in ("\n\n", "\n", ". ", "! ", "? "):
+        position = cut.rfind(boundary)
+        if position > limit // 2:
+            return cut[:position + (1 if boundary.strip() else 0)].rstrip()
+    return cut[:cut.rfind(" ")].rstrip() + "…"
+
+
+def finalize(draft: str, max_length: int = FINAL_MAX_LENGTH) -> FinalizedResponse:
+    """
+    Mechanical version of the final synthesizer pass: Markdown cleanup, deduplication,
+    the consult-a-professional reminder and the length limit. `issues` lists what could not
+    be fixed mechanically; the caller should only ask the LLM synthesizer when it is non-empty.
+    """
+    issues = []
+    text = _deduplicate(_normalize_markdown(draft or ""))
+
+    if _agent_trace_pattern.search(text):
+        issues.append("agent scaffolding in the answer")
+    if len(text) < FINAL_MIN_LENGTH:
+        issues.append("answer too short")
+    if len(text) > max_length * 3:
+        # Cutting this much would lose most of the answer; it needs a rewrite, not a trim.
+        issues.append("answer far over the length limit")
+    if text.count("```") % 2:
+        issues.append("unbalanced code fence")
+
+    # Checked on what is kept: a mention in the part that gets cut does not count.
+    truncated = _truncate(text, max_length)
+    if _professional_pattern.search(truncated):
+        text = truncated
+    else:
+        text = f"{_truncate(text, max_length - len(DISCLAIMER) - 2)}\n\n{DISCLAIMER}"
+    return FinalizedResponse(text=text, issues=issues)
@@ -0,0 +1,176 @@
+from .backends import backends
+from .crew_runner import crew_runner, CrewBusyError
+from .tracing import Trace, current_trace
+import hashlib
+import logging
+import asyncio
+import json
+import time
+import uuid
+import os
+
+logger = logging.getLogger(__name__)
+
+JOB_TTL = int(os.getenv("JOB_TTL", str(24 * 3600)))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "600"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", os.getenv("CREW_MAX_WORKERS", "2")))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "50"))
+JOB_BUSY_RETRY = float(os.getenv("JOB_BUSY_RETRY", "2"))
+JOB_BUSY_MAX_RETRIES = int(os.getenv("JOB_BUSY_MAX_RETRIES", "150"))
+# Outlives the slowest possible run, so a crashed worker cannot pin a query forever.
+JOB_DEDUPE_TTL = int(JOB_TIMEOUT) + 60
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised when the job queue already holds JOB_MAX_QUEUE jobs."""
+
+
+class JobManager:
+    """
+    Runs crew research requests in the background and keeps their state in the Redis store.
+    Submitting returns a job ID at once; JOB_WORKERS consumers feed the queue into the crew
+    runner and write the status and result under a key that expires after JOB_TTL. An identical
+    query from the same session while a job is queued or running returns that job instead.
+    The queue itself lives in the process, so jobs still queued at shutdown are marked failed.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_MAX_QUEUE, prefix: str = "babynest:job"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.prefix = prefix
+        self._queue: asyncio.Queue | None = None
+        self._consumers: list[asyncio.Task] = []
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}:{job_id}"
+
+    def _dedupe_key(self, session_id: str | None, query: str) -> str:
+        normalized = " ".join(query.lower().split())
+        digest = hashlib.sha256(f"{session_id or ''}\x00{normalized}".encode("utf-8")).hexdigest()
+        return f"{self.prefix}:inflight:{digest}"
+
+    def start(self) -> None:
+        if self._consumers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        while self._queue is not None and not self._queue.empty():
+            job = self._queue.get_nowait()
+            await self._update(job, status=FAILED, error="The server restarted before the job ran.")
+        self._queue = None
+
+    async def _save(self, job: dict) -> None:
+        store = await backends.aget("store")
+        await store.call("setex", self._key(job["job_id"]), JOB_TTL, json.dumps(job))
+
+    async def _update(self, job: dict, **changes) -> None:
+        job.update(changes, updated_at=time.time())
+        try:
+            await self._save(job)
+        except Exception as e:
+            logger.error(f"Failed to save job {job['job_id']}: {e}")
+        if job["status"] in (SUCCEEDED, FAILED):
+            try:
+                store = await backends.aget("store")
+                await store.call("delete", job["dedupe_key"])
+            except Exception as e:
+                logger.warning(f"Failed to release the dedupe key of job {job['job_id']}: {e}")
+
+    async def get(self, job_id: str) -> dict | None:
+        store = await backends.aget("store")
+        raw = await store.call("get", self._key(job_id))
+        return json.loads(raw) if raw else None
+
+    async def submit(self, query: str, session_id: str | None = None) -> tuple[dict, bool]:
+        """Queues a crew run; returns (job, created). `created` is False for a deduplicated submission."""
+        self.start()
+        store = await backends.aget("store")
+        job_id = uuid.uuid4().hex
+        dedupe_key = self._dedupe_key(session_id, query)
+        claimed, ttl, owner = await store.pipeline([
+            ("setnx", dedupe_key, job_id),
+            ("ttl", dedupe_key),
+            ("get", dedupe_key),
+        ], transaction=True)
+        # Only a key without an expiry (a fresh claim) gets the TTL; duplicates must not extend it.
+        if ttl == -1:
+            await store.call("expire", dedupe_key, JOB_DEDUPE_TTL)
+        if not claimed and owner:
+            existing = await self.get(owner)
+            if existing is not None and existing["status"] in (QUEUED, RUNNING):
+                logger.info(f"Deduplicated job submission onto {owner}")
+                return existing, False
+            await store.call("setex", dedupe_key, JOB_DEDUPE_TTL, job_id)
+
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "status": QUEUED,
+            "query": query,
+            "session_id": session_id,
+            "dedupe_key": dedupe_key,
+            "output": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if self._queue.full():
+            await store.call("delete", dedupe_key)
+            raise JobQueueFull(f"{self.max_queue} jobs already queued")
+        # Saved before queueing, so a consumer's "running" update can never be overwritten.
+        await self._save(job)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            await self._update(job, status=FAILED, error="The job queue was full.")
+            raise JobQueueFull(f"{self.max_queue} jobs already queued")
+        return job, True
+
+    async def _run(self, job: dict) -> None:
+        await self._update(job, status=RUNNING)
+        for attempt in range(JOB_BUSY_MAX_RETRIES + 1):
+            try:
+                response = await crew_runner.run(job["query"], timeout=JOB_TIMEOUT)
+                await self._update(job, status=SUCCEEDED, output=response.raw)
+                return
+            except CrewBusyError:
+                # Synchronous crew requests share the runner; wait for a free slot instead of failing.
+                if attempt < JOB_BUSY_MAX_RETRIES:
+                    await asyncio.sleep(JOB_BUSY_RETRY)
+            except asyncio.TimeoutError:
+                await self._update(job, status=FAILED, error="The research request took too long to complete.")
+                return
+            except asyncio.CancelledError:
+                await self._update(job, status=FAILED, error="The server restarted while the job was running.")
+                raise
+            except Exception as e:
+                logger.exception(f"Job {job['job_id']} failed")
+                await self._update(job, status=FAILED, error="The research request failed.")
+                return
+        logger.warning(f"Job {job['job_id']} gave up after {JOB_BUSY_MAX_RETRIES} busy retries")
+        await self._update(job, status=FAILED, error="Our research assistant stayed busy, please try again later.")
+
+    async def _consume(self) -> None:
+        # Consumers may be started from inside a request; jobs must not report into its trace.
+        current_trace.set(None)
+        while True:
+            job = await self._queue.get()
+            trace = Trace(tags={"path": "job", "route": "crewai", "session": job["session_id"]})
+            token = current_trace.set(trace)
+            try:
+                await self._run(job)
+            finally:
+                current_trace.reset(token)
+                trace.finish()
+                self._queue.task_done()
+
+
+job_manager = JobManager()
@@ -0,0 +1,124 @@
+from pathlib import Path
+import numpy as np
+import logging
+import shutil
+import json
+import re
+
+logger = logging.getLogger(__name__)
+
+_token_pattern = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased alphanumeric tokens; numbers are kept so "week 6" and drug doses still match."""
+    return _token_pattern.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the ingested chunks, stored as flat postings arrays.
+    The index is built once during ingestion and loaded with numpy memory-mapping,
+    so startup does not re-tokenize the corpus and a query only touches the postings
+    of its own terms.
+    """
+
+    def __init__(self, directory: Path, doc_ids: list[str], vocabulary: dict[str, int], meta: dict, mmap_mode: str | None = "r"):
+        self.directory = Path(directory)
+        self.doc_ids = doc_ids
+        self.vocabulary = vocabulary
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.avgdl = meta["avgdl"]
+        self.indptr = np.load(self.directory/"indptr.npy", mmap_mode=mmap_mode)
+        self.postings_docs = np.load(self.directory/"postings_docs.npy", mmap_mode=mmap_mode)
+        self.postings_tf = np.load(self.directory/"postings_tf.npy", mmap_mode=mmap_mode)
+        self.idf = np.load(self.directory/"idf.npy", mmap_mode=mmap_mode)
+        self.doc_len = np.load(self.directory/"doc_len.npy", mmap_mode=mmap_mode)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, directory: Path, doc_ids: list[str], texts: list[str]) -> None:
+        """Builds the index with rank_bm25's BM25Okapi weighting and publishes it atomically."""
+        from rank_bm25 import BM25Okapi
+
+        directory = Path(directory)
+        tokenized = [tokenize(text) for text in texts]
+        if not any(tokenized):
+            logger.warning("No documents to index for BM25")
+            return
+        bm25 = BM25Okapi(tokenized)
+
+        vocabulary = {term: index for index, term in enumerate(sorted(bm25.idf))}
+        postings = [[] for _ in vocabulary]
+        for doc_index, frequencies in enumerate(bm25.doc_freqs):
+            for term, tf in frequencies.items():
+                postings[vocabulary[term]].append((doc_index, tf))
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(entries) for entries in postings])
+        postings_docs = np.fromiter((doc for entries in postings for doc, _ in entries), dtype=np.int32, count=int(indptr[-1]))
+        postings_tf = np.fromiter((tf for entries in postings for _, tf in entries), dtype=np.float32, count=int(indptr[-1]))
+        idf = np.array([bm25.idf[term] for term in vocabulary], dtype=np.float32)
+
+        staging = directory.with_name(directory.name + ".tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        np.save(staging/"indptr.npy", indptr)
+        np.save(staging/"postings_docs.npy", postings_docs)
+        np.save(staging/"postings_tf.npy", postings_tf)
+        np.save(staging/"idf.npy", idf)
+        np.save(staging/"doc_len.npy", np.asarray(bm25.doc_len, dtype=np.float32))
+        (staging/"doc_ids.json").write_text(json.dumps(doc_ids), encoding="utf-8")
+        (staging/"vocabulary.json").write_text(json.dumps(vocabulary), encoding="utf-8")
+        (staging/"meta.json").write_text(json.dumps({"k1": bm25.k1, "b": bm25.b, "avgdl": bm25.avgdl}), encoding="utf-8")
+
+        previous = directory.with_name(directory.name + ".old")
+        shutil.rmtree(previous, ignore_errors=True)
+        if directory.exists():
+            directory.rename(previous)
+        staging.rename(directory)
+        shutil.rmtree(previous, ignore_errors=True)
+        logger.info(f"Built BM25 index over {len(doc_ids)} chunks and {len(vocabulary)} terms")
+
+    @classmethod
+    def load(cls, directory: Path) -> "BM25Index | None":
+        directory = Path(directory)
+        if not (directory/"meta.json").exists():
+            logger.warning(f"No BM25 index at {directory}, hybrid retrieval falls back to vector search")
+            return None
+        return cls(
+            directory,
+            doc_ids=json.loads((directory/"doc_ids.json").read_text(encoding="utf-8")),
+            vocabulary=json.loads((directory/"vocabulary.json").read_text(encoding="utf-8")),
+            meta=json.loads((directory/"meta.json").read_text(encoding="utf-8")),
+        )
+
+    def search(self, query: str, k: int = 20) -> list[tuple[str, float]]:
+        """Returns up to k (chunk_id, score) pairs, best first."""
+        term_ids = {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}
+        if not term_ids:
+            return []
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / self.avgdl)
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + norm)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    """Fuses several ranked ID lists; each list contributes 1 / (k + rank) per ID."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
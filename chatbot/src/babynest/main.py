@@ -2,8 +2,6 @@
 import sys
 import warnings
 
-from datetime import datetime
-
 from babynest.crew import Babynest
 
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
@@ -13,13 +11,15 @@ warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
 # Replace with inputs you want to test with, it will automatically
 # interpolate any tasks and agents information
 
+SAMPLE_QUERY = "What are the common warning signs of preeclampsia in the third trimester?"
+
 def run():
     """
     Run the crew.
     """
     inputs = {
-        'topic': 'AI LLMs',
-        'current_year': str(datetime.now().year)
+        'user_query': SAMPLE_QUERY,
+        'prefetched_context': ''
     }
     
     try:
@@ -33,8 +33,8 @@ def train():
     Train the crew for a given number of iterations.
     """
     inputs = {
-        "topic": "AI LLMs",
-        'current_year': str(datetime.now().year)
+        "user_query": SAMPLE_QUERY,
+        "prefetched_context": ""
     }
     try:
         Babynest().crew().train(n_iterations=int(sys.argv[1]), filename=sys.argv[2], inputs=inputs)
@@ -57,8 +57,8 @@ def test():
     Test the crew execution and returns the results.
     """
     inputs = {
-        "topic": "AI LLMs",
-        "current_year": str(datetime.now().year)
+        "user_query": SAMPLE_QUERY,
+        "prefetched_context": ""
     }
     
     try:
@@ -0,0 +1,183 @@
+from fastapi import Request
+from dataclasses import dataclass
+from .backends import backends
+from .tracing import span
+import threading
+import logging
+import hashlib
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Buckets are measured in chat requests: the defaults keep the old 5/minute for plain chat.
+RATE_LIMIT_CAPACITY = float(os.getenv("RATE_LIMIT_CAPACITY", "5"))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "5"))
+# How long to stay on the local buckets after the shared store fails before trying it again.
+RATE_LIMIT_STORE_RETRY = float(os.getenv("RATE_LIMIT_STORE_RETRY", "30"))
+RATE_LIMIT_LOCAL_MAX_KEYS = int(os.getenv("RATE_LIMIT_LOCAL_MAX_KEYS", "10000"))
+
+
+def _parse_costs(raw: str) -> dict[str, float]:
+    costs = {}
+    for item in raw.split(","):
+        route, _, cost = item.partition("=")
+        if route.strip() and cost.strip():
+            costs[route.strip()] = float(cost)
+    return costs
+
+
+# A crew run costs a whole minute of budget; the cost is clamped to the capacity so it can always pass eventually.
+ROUTE_COSTS = _parse_costs(os.getenv("RATE_LIMIT_COSTS", "langchain=1,crewai=5"))
+
+# Refills and charges every bucket in KEYS atomically; the request is allowed only if all of them
+# hold `cost` tokens. Redis' own clock is used so replicas with skewed clocks agree. Fractional
+# values are returned as strings because Redis truncates Lua numbers to integers.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local ttl = math.ceil(capacity / rate) + 1
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+local allowed = 0
+if wait == 0 then
+    allowed = 1
+    for i, key in ipairs(KEYS) do
+        levels[i] = levels[i] - cost
+        redis.call('HSET', key, 'tokens', tostring(levels[i]), 'ts', tostring(now))
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+local remaining = capacity
+for i = 1, #levels do
+    remaining = math.min(remaining, levels[i])
+end
+return {allowed, tostring(wait), tostring(remaining)}
+"""
+
+
+@dataclass
+class RateLimitDecision:
+    allowed: bool
+    retry_after: float
+    remaining: float
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a client's token bucket cannot cover the cost of a request."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class LocalTokenBuckets:
+    """The same token buckets in process memory, used when the shared store is unavailable."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_LOCAL_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float, capacity: float, rate: float) -> None:
+        # A bucket idle long enough to be full again carries no information.
+        full_after = capacity / rate
+        self._buckets = {key: state for key, state in self._buckets.items() if now - state[1] < full_after}
+
+    def take(self, keys: list[str], capacity: float, rate: float, cost: float) -> RateLimitDecision:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) > self.max_keys:
+                self._prune(now, capacity, rate)
+            levels = []
+            for key in keys:
+                tokens, ts = self._buckets.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + max(0.0, now - ts) * rate))
+            wait = max([(cost - tokens) / rate for tokens in levels if tokens < cost], default=0.0)
+            if wait == 0:
+                levels = [tokens - cost for tokens in levels]
+                for key, tokens in zip(keys, levels):
+                    self._buckets[key] = (tokens, now)
+        return RateLimitDecision(allowed=wait == 0, retry_after=wait, remaining=min(levels, default=capacity))
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiting shared by every worker and replica through the Redis store.
+    Each client has one bucket per IP address and one per session; a request is charged its
+    route's cost (ROUTE_COSTS) against both in a single atomic script. When the store cannot run
+    scripts or is unreachable, the limiter falls back to per-process buckets until it recovers.
+    """
+
+    def __init__(
+        self,
+        capacity: float = RATE_LIMIT_CAPACITY,
+        per_minute: float = RATE_LIMIT_PER_MINUTE,
+        costs: dict[str, float] | None = None,
+        prefix: str = "babynest:ratelimit",
+        enabled: bool = RATE_LIMIT_ENABLED
+    ):
+        self.capacity = capacity
+        self.rate = per_minute / 60
+        self.costs = ROUTE_COSTS if costs is None else costs
+        self.prefix = prefix
+        self.enabled = enabled
+        self.local = LocalTokenBuckets()
+        self._store_retry_at = 0.0
+
+    def cost(self, route: str) -> float:
+        return min(self.costs.get(route, 1.0), self.capacity)
+
+    def keys(self, request: Request, session_id: str | None) -> list[str]:
+        host = request.client.host if request.client else "unknown"
+        keys = [f"{self.prefix}:ip:{host}"]
+        if session_id:
+            digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+            keys.append(f"{self.prefix}:session:{digest}")
+        return keys
+
+    async def take(self, keys: list[str], cost: float) -> RateLimitDecision:
+        if time.monotonic() >= self._store_retry_at:
+            try:
+                store = await backends.aget("store")
+                with span("rate_limit"):
+                    allowed, wait, remaining = await store.eval(
+                        TOKEN_BUCKET_SCRIPT, keys, [self.capacity, self.rate, cost]
+                    )
+                return RateLimitDecision(allowed=int(allowed) == 1, retry_after=float(wait), remaining=float(remaining))
+            except NotImplementedError:
+                # The in-process store cannot run scripts; it is per-process anyway.
+                self._store_retry_at = float("inf")
+            except Exception as e:
+                logger.warning(f"Shared rate limit unavailable, using local buckets for {RATE_LIMIT_STORE_RETRY:.0f}s: {e}")
+                self._store_retry_at = time.monotonic() + RATE_LIMIT_STORE_RETRY
+        return self.local.take(keys, self.capacity, self.rate, cost)
+
+    async def check(self, request: Request, session_id: str | None, route: str, paid: float = 0.0) -> None:
+        """
+        Charges the cost of `route`, less `paid` already charged for this request.
+        Raises RateLimitExceeded when the client's buckets cannot cover it.
+        """
+        cost = self.cost(route) - paid
+        if not self.enabled or cost <= 0:
+            return
+        decision = await self.take(self.keys(request, session_id), cost)
+        if not decision.allowed:
+            raise RateLimitExceeded(decision.retry_after)
+
+
+rate_limiter = RateLimiter()
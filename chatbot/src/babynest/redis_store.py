@@ -0,0 +1,256 @@
+from fnmatch import fnmatch
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class RedisStore:
+    """
+    Minimal async Redis interface shared by conversation memory and the caches.
+    Commands are plain tuples such as ("rpush", key, value) so the same calls work against
+    Upstash, a regular Redis server or the in-process stand-in used for tests.
+    """
+
+    name = "redis"
+
+    async def call(self, command: str, *args):
+        raise NotImplementedError
+
+    async def pipeline(self, commands: list[tuple], transaction: bool = False) -> list:
+        """Sends all commands in one round-trip and returns their results in order."""
+        raise NotImplementedError
+
+    async def eval(self, script: str, keys: list[str], args: list):
+        raise NotImplementedError
+
+    async def ping(self) -> bool:
+        return bool(await self.call("ping"))
+
+    async def close(self) -> None:
+        pass
+
+
+class UpstashStore(RedisStore):
+    """Upstash over its REST API with the native async client, which keeps one pooled HTTP session."""
+
+    name = "upstash"
+
+    def __init__(self, url: str, token: str):
+        from upstash_redis.asyncio import Redis as AsyncRedis
+
+        self.client = AsyncRedis(url=url, token=token)
+
+    async def call(self, command: str, *args):
+        return await getattr(self.client, command)(*args)
+
+    async def pipeline(self, commands: list[tuple], transaction: bool = False) -> list:
+        pipe = self.client.multi() if transaction else self.client.pipeline()
+        for command, *args in commands:
+            getattr(pipe, command)(*args)
+        return await pipe.exec()
+
+    async def eval(self, script: str, keys: list[str], args: list):
+        return await self.client.eval(script, keys=keys, args=args)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class LocalRedisStore(RedisStore):
+    """A regular Redis server through redis-py's asyncio client and its connection pool."""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+
+        self.client = aioredis.Redis.from_url(url, decode_responses=True)
+
+    async def call(self, command: str, *args):
+        return await getattr(self.client, command)(*args)
+
+    async def pipeline(self, commands: list[tuple], transaction: bool = False) -> list:
+        async with self.client.pipeline(transaction=transaction) as pipe:
+            for command, *args in commands:
+                getattr(pipe, command)(*args)
+            return await pipe.execute()
+
+    async def eval(self, script: str, keys: list[str], args: list):
+        return await self.client.eval(script, len(keys), *keys, *args)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class InMemoryStore(RedisStore):
+    """
+    In-process stand-in implementing the subset of Redis commands BabyNest uses.
+    Meant for tests, benchmarks and local development; data lives only as long as the process.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def _list(self, key) -> list:
+        if not self._alive(key):
+            self._data[key] = []
+        return self._data[key]
+
+    @staticmethod
+    def _slice(length: int, start: int, stop: int) -> slice:
+        """Redis range semantics: inclusive stop, and a range that ends before it starts is empty."""
+        if start < 0:
+            start = max(length + start, 0)
+        if stop < 0:
+            stop = length + stop
+        if stop < 0 or start > stop:
+            # Python slicing would wrap a still-negative stop around; Redis returns nothing.
+            return slice(0, 0)
+        return slice(start, stop + 1)
+
+    def _ping(self):
+        return True
+
+    def _get(self, key):
+        return self._data.get(key) if self._alive(key) else None
+
+    def _mget(self, *keys):
+        return [self._get(key) for key in keys]
+
+    def _set(self, key, value):
+        self._data[key] = value
+        self._expires.pop(key, None)
+        return True
+
+    def _setex(self, key, seconds, value):
+        self._data[key] = value
+        self._expires[key] = time.time() + int(seconds)
+        return True
+
+    def _setnx(self, key, value):
+        if self._alive(key):
+            return False
+        return self._set(key, value)
+
+    def _incr(self, key):
+        value = int(self._get(key) or 0) + 1
+        self._data[key] = str(value)
+        return value
+
+    def _delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                removed += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return removed
+
+    def _exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    def _expire(self, key, seconds):
+        if not self._alive(key):
+            return False
+        self._expires[key] = time.time() + int(seconds)
+        return True
+
+    def _ttl(self, key):
+        if not self._alive(key):
+            return -2
+        expires = self._expires.get(key)
+        return -1 if expires is None else int(expires - time.time())
+
+    def _keys(self, pattern):
+        return [key for key in list(self._data) if self._alive(key) and fnmatch(key, pattern)]
+
+    def _append(self, key, value):
+        current = (self._get(key) or "") + value
+        self._data[key] = current
+        return len(current)
+
+    def _getrange(self, key, start, end):
+        value = self._get(key) or ""
+        return value[self._slice(len(value), int(start), int(end))]
+
+    def _rpush(self, key, *values):
+        items = self._list(key)
+        items.extend(values)
+        return len(items)
+
+    def _lpush(self, key, *values):
+        items = self._list(key)
+        for value in values:
+            items.insert(0, value)
+        return len(items)
+
+    def _llen(self, key):
+        return len(self._data[key]) if self._alive(key) else 0
+
+    def _lrange(self, key, start, stop):
+        if not self._alive(key):
+            return []
+        items = self._data[key]
+        return list(items[self._slice(len(items), int(start), int(stop))])
+
+    def _ltrim(self, key, start, stop):
+        if self._alive(key):
+            items = self._data[key]
+            self._data[key] = items[self._slice(len(items), int(start), int(stop))]
+            if not self._data[key]:
+                self._delete(key)
+        return True
+
+    def _run(self, command: str, *args):
+        handler = getattr(self, f"_{command}", None)
+        if handler is None:
+            raise NotImplementedError(f"InMemoryStore does not support {command.upper()}")
+        return handler(*args)
+
+    async def call(self, command: str, *args):
+        with self._lock:
+            return self._run(command, *args)
+
+    async def pipeline(self, commands: list[tuple], transaction: bool = False) -> list:
+        # Holding the lock for the whole batch makes every pipeline behave like MULTI/EXEC.
+        with self._lock:
+            return [self._run(command, *args) for command, *args in commands]
+
+    async def eval(self, script: str, keys: list[str], args: list):
+        raise NotImplementedError("InMemoryStore cannot run Lua scripts")
+
+
+def create_store() -> RedisStore:
+    """
+    Builds the store selected by MEMORY_BACKEND: "upstash" (the default when Upstash credentials
+    are set), "redis" for a regular server at REDIS_URL, or "memory" for the in-process stand-in.
+    """
+    backend = os.getenv("MEMORY_BACKEND", "").lower()
+    if not backend:
+        if os.getenv("UPSTASH_REDIS_REST_URL"):
+            backend = "upstash"
+        elif os.getenv("REDIS_URL"):
+            backend = "redis"
+        else:
+            backend = "memory"
+    if backend == "upstash":
+        return UpstashStore(url=os.getenv("UPSTASH_REDIS_REST_URL"), token=os.getenv("UPSTASH_REDIS_REST_TOKEN"))
+    if backend == "redis":
+        return LocalRedisStore(url=os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    if backend != "memory":
+        logger.warning(f"Unknown MEMORY_BACKEND {backend!r}, using the in-process store")
+    return InMemoryStore()
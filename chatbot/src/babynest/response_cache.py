@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import numpy as np
+import base64
+import logging
+import json
+import time
+import re
+import uuid
+import os
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    query: str
+    answer: str
+    route: str
+    vector: np.ndarray
+    expires_at: float
+
+
+_number_pattern = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def _numbers(text: str) -> list[str]:
+    """Numeric tokens of a query; "week 6" and "week 16" embed almost identically but differ here."""
+    return sorted(_number_pattern.findall(text))
+
+
+def _normalize(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class LocalSemanticCache:
+    """
+    In-process semantic cache of previous answers.
+    A lookup returns the most similar stored answer whose query embedding has a cosine
+    similarity of at least `threshold` and whose query has exactly the same numbers. Entries
+    expire after `ttl` seconds and the least recently used entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 86400, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._ids: list[str] = []
+        self._matrix = None
+
+    def _evict(self) -> None:
+        now = time.time()
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if expired or self._matrix is not None and len(self._ids) != len(self._entries):
+            self._matrix = None
+
+    def _search(self, vector: np.ndarray, query: str) -> CacheEntry | None:
+        self._evict()
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._ids = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[key].vector for key in self._ids])
+        scores = self._matrix @ vector
+        numbers = _numbers(query)
+        now = time.time()
+        for index in np.argsort(-scores):
+            if scores[index] < self.threshold:
+                return None
+            key = self._ids[int(index)]
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now or _numbers(entry.query) != numbers:
+                continue
+            self._entries.move_to_end(key)
+            logger.info(f"Semantic cache hit (similarity {scores[index]:.3f})")
+            return entry
+        return None
+
+    def _add(self, key: str, entry: CacheEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._matrix = None
+        self._evict()
+
+    async def lookup(self, embedding, query: str) -> CacheEntry | None:
+        return self._search(_normalize(embedding), query)
+
+    async def store(self, query: str, embedding, answer: str, route: str) -> None:
+        self._add(uuid.uuid4().hex, CacheEntry(query, answer, route, _normalize(embedding), time.time() + self.ttl))
+
+
+class RedisSemanticCache(LocalSemanticCache):
+    """
+    Semantic cache shared by every worker through Redis.
+    Entries live under their own key with a TTL and a capped index list records the newest IDs.
+    Each process keeps a decoded mirror of the entries, so a lookup costs one LRANGE plus an
+    MGET of only the entries this process has not seen yet.
+    """
+
+    def __init__(self, store, prefix: str = "babynest:semcache", **kwargs):
+        super().__init__(**kwargs)
+        self.redis_store = store
+        self.index_key = f"{prefix}:index"
+        self.entry_prefix = f"{prefix}:entry:"
+
+    @staticmethod
+    def _encode(entry: CacheEntry) -> str:
+        return json.dumps({
+            "query": entry.query,
+            "answer": entry.answer,
+            "route": entry.route,
+            "expires_at": entry.expires_at,
+            "vector": base64.b64encode(entry.vector.astype(np.float16).tobytes()).decode("ascii"),
+        })
+
+    @staticmethod
+    def _decode(raw: str) -> CacheEntry:
+        data = json.loads(raw)
+        vector = np.frombuffer(base64.b64decode(data["vector"]), dtype=np.float16).astype(np.float32)
+        return CacheEntry(data["query"], data["answer"], data["route"], _normalize(vector), data["expires_at"])
+
+    async def _sync(self) -> None:
+        ids = await self.redis_store.call("lrange", self.index_key, 0, self.max_entries - 1) or []
+        live = set(ids)
+        for key in [key for key in self._entries if key not in live]:
+            del self._entries[key]
+            self._matrix = None
+        missing = [key for key in ids if key not in self._entries]
+        if missing:
+            raws = await self.redis_store.call("mget", *[self.entry_prefix + key for key in missing])
+            for key, raw in zip(missing, raws):
+                if raw:
+                    self._add(key, self._decode(raw))
+
+    async def lookup(self, embedding, query: str) -> CacheEntry | None:
+        try:
+            await self._sync()
+        except Exception as e:
+            logger.warning(f"Failed to sync the semantic cache from Redis: {e}")
+        return await super().lookup(embedding, query)
+
+    async def store(self, query: str, embedding, answer: str, route: str) -> None:
+        key = uuid.uuid4().hex
+        entry = CacheEntry(query, answer, route, _normalize(embedding), time.time() + self.ttl)
+        self._add(key, entry)
+        try:
+            await self.redis_store.pipeline([
+                ("setex", self.entry_prefix + key, int(self.ttl), self._encode(entry)),
+                ("lpush", self.index_key, key),
+                ("ltrim", self.index_key, 0, self.max_entries - 1),
+                ("expire", self.index_key, int(self.ttl)),
+            ])
+        except Exception as e:
+            logger.warning(f"Failed to store the semantic cache entry in Redis: {e}")
+
+
+# Answers are only cached for opening questions, so lookups past the first turn cannot hit anyway.
+SEMANTIC_CACHE_MAX_HISTORY = int(os.getenv("SEMANTIC_CACHE_MAX_HISTORY", "0"))
+
+
+def create_response_cache(store=None) -> LocalSemanticCache | None:
+    """Builds the cache selected by SEMANTIC_CACHE_BACKEND (local, redis or off)."""
+    backend = os.getenv("SEMANTIC_CACHE_BACKEND", "local").lower()
+    options = dict(
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "86400")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000")),
+    )
+    if backend == "off":
+        return None
+    if backend == "redis":
+        if store is not None:
+            return RedisSemanticCache(store, **options)
+        logger.warning("Redis is unavailable, falling back to the in-process semantic cache")
+    return LocalSemanticCache(**options)
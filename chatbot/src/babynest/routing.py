@@ -0,0 +1,181 @@
+from pathlib import Path
+import numpy as np
+import threading
+import logging
+import json
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ("langchain", "crewai")
+DEFAULT_ROUTE = "langchain"
+ROUTER_CONFIDENCE_MARGIN = float(os.getenv("ROUTER_CONFIDENCE_MARGIN", "0.05"))
+# Off by default: the log keeps raw user queries on disk.
+ROUTER_LOG_ENABLED = os.getenv("ROUTER_LOG_ENABLED", "false").lower() == "true"
+ROUTER_LOG_MAX_EXAMPLES = int(os.getenv("ROUTER_LOG_MAX_EXAMPLES", "2000"))
+ROUTER_BUILD_BATCH_SIZE = int(os.getenv("ROUTER_BUILD_BATCH_SIZE", "96"))
+
+# The examples from the router prompt, plus a few more in the same spirit.
+ROUTER_EXAMPLES = [
+    ("What is postpartum depression?", "langchain"),
+    ("Can you create a report about breastfeeding techniques?", "crewai"),
+    ("I feel tired all the time after delivery.", "langchain"),
+    ("Please research and summarize WHO guidelines on infant nutrition.", "crewai"),
+    ("Tell me what BabyNest does.", "langchain"),
+    ("Help me find clinical evidence for home births.", "crewai"),
+    ("Is it normal to have cramps in the first trimester?", "langchain"),
+    ("Hi, I just found out I'm pregnant!", "langchain"),
+    ("Write a week by week nutrition plan for my pregnancy.", "crewai"),
+    ("Compare the evidence on epidurals versus natural birth and what mothers say about them.", "crewai"),
+]
+
+# Only explicit requests for research work; questions that merely mention guidelines or studies stay in chat.
+_crewai_keywords = re.compile(
+    r"\b(write|create|make|prepare|generate|produce|draft|compile|put together)\b"
+    r"(?: [\w-]+){0,4}? (report|summary|analysis|overview|literature review)\b"
+    r"|\b(summari[sz]e|research|analy[sz]e|compare|investigate|find|look up|search for|dig into)\b"
+    r"(?: [\w-]+){0,3}? (research|evidence|studies|literature|guidelines|sources)\b"
+    r"|\bweek[- ]by[- ]week (plan|guide)\b|\bdo (some )?research\b"
+)
+_langchain_keywords = re.compile(
+    r"^(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening)|ok|okay|bye)\b|\bbabynest\b"
+)
+
+
+def normalize_route(raw: str) -> str:
+    """Maps free-form router output such as " Crewai" or "`langchain`." onto a known route."""
+    text = (raw or "").strip().lower()
+    for route in ROUTES:
+        if route in text:
+            return route
+    logger.warning(f"Unrecognized router output {raw!r}, using {DEFAULT_ROUTE}")
+    return DEFAULT_ROUTE
+
+
+def keyword_route(query: str) -> str | None:
+    """Cheap rules for unambiguous queries; None when they do not decide."""
+    text = " ".join(query.lower().split())
+    wants_research = bool(_crewai_keywords.search(text))
+    is_chat = bool(_langchain_keywords.search(text))
+    if wants_research and not is_chat:
+        return "crewai"
+    if is_chat and not wants_research:
+        return "langchain"
+    if len(text.split()) <= 3 and not wants_research:
+        return "langchain"
+    return None
+
+
+class CentroidRouter:
+    """
+    Nearest-centroid classifier over query embeddings.
+    Each route keeps the running sum of its examples' normalized embeddings, so new labelled
+    queries are folded in with a single vector addition. A decision is confident when the best
+    route beats the other by at least `margin` in cosine similarity.
+    """
+
+    def __init__(self, margin: float = ROUTER_CONFIDENCE_MARGIN):
+        self.margin = margin
+        self._sums: dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def learn(self, route: str, embedding) -> None:
+        vector = self._normalize(embedding)
+        with self._lock:
+            if route in self._sums:
+                self._sums[route] = self._sums[route] + vector
+            else:
+                self._sums[route] = vector
+
+    def classify(self, embedding) -> tuple[str | None, float]:
+        """Returns (route, margin); the route is None when the margin is below the threshold."""
+        with self._lock:
+            if len(self._sums) < len(ROUTES):
+                return None, 0.0
+            centroids = {route: self._normalize(total) for route, total in self._sums.items()}
+        vector = self._normalize(embedding)
+        scores = sorted(((float(centroid @ vector), route) for route, centroid in centroids.items()), reverse=True)
+        margin = scores[0][0] - scores[1][0]
+        return (scores[0][1] if margin >= self.margin else None), margin
+
+    @classmethod
+    def build(cls, embeddings, examples: list[tuple[str, str]], batch_size: int = ROUTER_BUILD_BATCH_SIZE) -> "CentroidRouter":
+        router = cls()
+        # Examples must be embedded as queries: classify() and learn() get query embeddings,
+        # and models such as Cohere embed documents into a different space.
+        embed_queries = getattr(embeddings, "embed_queries", None) or (lambda texts: [embeddings.embed_query(t) for t in texts])
+        for start in range(0, len(examples), batch_size):
+            batch = examples[start:start + batch_size]
+            vectors = embed_queries([query for query, _ in batch])
+            for (_, route), vector in zip(batch, vectors):
+                router.learn(route, vector)
+        logger.info(f"Built the routing classifier from {len(examples)} examples")
+        return router
+
+
+class RoutingLog:
+    """
+    Append-only JSONL of queries the LLM router labelled, used to train the classifier on real traffic.
+    Disabled unless ROUTER_LOG_ENABLED is set. Once the file holds twice `max_entries` lines it is
+    rewritten with only the newest `max_entries`, so it never grows past that.
+    """
+
+    def __init__(self, path: Path, enabled: bool = ROUTER_LOG_ENABLED, max_entries: int = ROUTER_LOG_MAX_EXAMPLES):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self._lines = None
+        self._lock = threading.Lock()
+
+    def _count_lines(self) -> int:
+        if not self.path.exists():
+            return 0
+        with open(self.path, encoding="utf-8") as f:
+            return sum(1 for _ in f)
+
+    def _compact(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.readlines()[-self.max_entries:]
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp, self.path)
+        self._lines = len(lines)
+
+    def append(self, query: str, route: str) -> None:
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self._lines is None:
+                    self._lines = self._count_lines()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"query": query, "route": route}) + "\n")
+                self._lines += 1
+                if self._lines >= 2 * self.max_entries:
+                    self._compact()
+        except Exception as e:
+            logger.warning(f"Failed to log the routing decision: {e}")
+
+    def examples(self, limit: int | None = None) -> list[tuple[str, str]]:
+        if not self.enabled or not self.path.exists():
+            return []
+        examples = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get("route") in ROUTES and entry.get("query"):
+                    # Later labels for the same query win.
+                    examples[entry["query"]] = entry["route"]
+        return list(examples.items())[-(limit or self.max_entries):]
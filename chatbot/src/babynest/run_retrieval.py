@@ -0,0 +1,70 @@
+from concurrent.futures import Future
+from .components import logger, retriever
+from .web_search import normalize_query
+import threading
+import asyncio
+
+
+class RunRetrieval:
+    """
+    Retrieval shared by every agent of one crew run.
+    The knowledge base and the web are searched for the user's query once, concurrently,
+    before kickoff, and the results are handed to the tasks as `prefetched_context`. Tool calls
+    made during the run are memoized per normalized query, and concurrent identical calls from
+    parallel branches wait for the first one instead of repeating it.
+    """
+
+    def __init__(self, user_query: str):
+        self.user_query = user_query
+        self._results: dict[tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def _memoized(self, kind: str, query: str, fetch) -> str:
+        key = (kind, normalize_query(query))
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = fetch(query)
+        except Exception as e:
+            # Failures are not memoized, so a later call may still succeed.
+            with self._lock:
+                self._results.pop(key, None)
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def _store(self, kind: str, query: str, result: str) -> None:
+        future = Future()
+        future.set_result(result)
+        with self._lock:
+            self._results.setdefault((kind, normalize_query(query)), future)
+
+    def rag(self, query: str) -> str:
+        return self._memoized("rag", query, lambda q: retriever.get_documents(query=q, route="crewai"))
+
+    def web(self, query: str) -> str:
+        return self._memoized("web", query, lambda q: "\n\n".join(retriever.web_search_tool(query=q)))
+
+    async def prefetch(self, embedding=None) -> str:
+        """Runs vector and web retrieval for the user's query concurrently and returns the combined context."""
+        knowledge, web = await asyncio.gather(
+            retriever.aget_documents(query=self.user_query, embedding=embedding, route="crewai"),
+            asyncio.to_thread(lambda: "\n\n".join(retriever.web_search_tool(query=self.user_query))),
+            return_exceptions=True
+        )
+        sections = []
+        if isinstance(knowledge, str) and knowledge:
+            self._store("rag", self.user_query, knowledge)
+            sections.append(f"Knowledge base:\n{knowledge}")
+        if isinstance(web, str) and web:
+            self._store("web", self.user_query, web)
+            sections.append(f"Web search:\n{web}")
+        elif isinstance(web, Exception):
+            logger.warning(f"Web prefetch failed, agents may search on their own: {web}")
+        return "\n\n".join(sections) or "No prefetched context is available; use your tools."
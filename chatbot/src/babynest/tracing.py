@@ -0,0 +1,230 @@
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from collections import deque
+import functools
+import asyncio
+import threading
+import inspect
+import logging
+import bisect
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUANTILES = (0.5, 0.95, 0.99)
+TRACE_SAMPLE_SIZE = int(os.getenv("TRACE_SAMPLE_SIZE", "1024"))
+TRACE_LOG = os.getenv("TRACE_LOG", "true").lower() == "true"
+
+
+class Histogram:
+    """Cumulative Prometheus-style buckets plus a window of recent samples for p50/p95/p99."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+        self.samples = deque(maxlen=TRACE_SAMPLE_SIZE)
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.errors += error
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Metrics:
+    """Per-(stage, route) latency histograms. Sessions are kept out of the labels to bound cardinality."""
+
+    def __init__(self):
+        self._histograms: dict[tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, route: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            histogram = self._histograms.get((stage, route))
+            if histogram is None:
+                histogram = self._histograms[(stage, route)] = Histogram()
+            histogram.observe(seconds, error)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                f"{stage}|{route}": {
+                    "stage": stage,
+                    "route": route,
+                    "count": histogram.count,
+                    "errors": histogram.errors,
+                    **{f"p{int(q * 100)}_ms": round(histogram.quantile(q) * 1000, 1) for q in QUANTILES},
+                }
+                for (stage, route), histogram in sorted(self._histograms.items())
+            }
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = [
+            "# HELP babynest_stage_duration_seconds Time spent per pipeline stage.",
+            "# TYPE babynest_stage_duration_seconds histogram",
+        ]
+        summary = [
+            "# HELP babynest_stage_latency_seconds Recent per-stage latency quantiles.",
+            "# TYPE babynest_stage_latency_seconds summary",
+        ]
+        errors = [
+            "# HELP babynest_stage_errors_total Stage executions that raised.",
+            "# TYPE babynest_stage_errors_total counter",
+        ]
+        with self._lock:
+            for (stage, route), histogram in sorted(self._histograms.items()):
+                labels = f'stage="{stage}",route="{route}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'babynest_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'babynest_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"babynest_stage_duration_seconds_sum{{{labels}}} {histogram.total:.6f}")
+                lines.append(f"babynest_stage_duration_seconds_count{{{labels}}} {histogram.count}")
+                for q in QUANTILES:
+                    summary.append(f'babynest_stage_latency_seconds{{{labels},quantile="{q}"}} {histogram.quantile(q):.6f}')
+                summary.append(f"babynest_stage_latency_seconds_sum{{{labels}}} {histogram.total:.6f}")
+                summary.append(f"babynest_stage_latency_seconds_count{{{labels}}} {histogram.count}")
+                errors.append(f"babynest_stage_errors_total{{{labels}}} {histogram.errors}")
+        return "\n".join(lines + summary + errors) + "\n"
+
+
+metrics = Metrics()
+
+
+@dataclass
+class Span:
+    stage: str
+    seconds: float
+    tags: dict
+    error: bool = False
+
+
+@dataclass
+class Trace:
+    """Spans of one request. They are flushed to the histograms when the request ends, once the route is known."""
+
+    tags: dict = field(default_factory=dict)
+    spans: list = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+
+    def finish(self) -> None:
+        elapsed = time.perf_counter() - self.started
+        route = str(self.tags.get("route", "none"))
+        for item in self.spans:
+            metrics.observe(item.stage, str(item.tags.get("route", route)), item.seconds, item.error)
+        metrics.observe("request", route, elapsed, self.tags.get("status", 200) >= 500)
+        if TRACE_LOG:
+            stages = " ".join(f"{item.stage}={item.seconds * 1000:.0f}ms" for item in self.spans)
+            logger.info(
+                f"trace path={self.tags.get('path')} route={route} session={self.tags.get('session')} "
+                f"status={self.tags.get('status')} total={elapsed * 1000:.0f}ms {stages}"
+            )
+
+
+current_trace: ContextVar[Trace | None] = ContextVar("babynest_trace", default=None)
+
+
+def set_tags(**tags) -> None:
+    """Tags the current request (e.g. route, session). Child tasks share the same Trace object."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.tags.update({key: value for key, value in tags.items() if value is not None})
+
+
+def record(stage: str, seconds: float, error: bool = False, **tags) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.spans.append(Span(stage, seconds, tags, error))
+    else:
+        metrics.observe(stage, str(tags.get("route", "none")), seconds, error)
+
+
+class span:
+    """
+    Times a stage. Works as a context manager in sync and async code and as a decorator
+    for plain and coroutine functions:
+
+        with span("retrieval"): ...
+
+        @span("tool.rag")
+        def rag_tool(query): ...
+    """
+
+    def __init__(self, stage: str, **tags):
+        self.stage = stage
+        self.tags = tags
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Stages cancelled because the route did not need them are not latency samples.
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            return False
+        record(self.stage, time.perf_counter() - self._started, exc_type is not None, **self.tags)
+        return False
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(self.stage, **self.tags):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.stage, **self.tags):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a Trace per HTTP request. It wraps the whole response,
+    so streamed bodies are timed until their last event.
+    """
+
+    def __init__(self, app, exclude: tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(tags={"path": scope["path"]})
+        token = current_trace.set(trace)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                trace.tags["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            trace.tags["status"] = 500
+            raise
+        finally:
+            current_trace.reset(token)
+            trace.finish()
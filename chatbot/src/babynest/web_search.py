@@ -0,0 +1,112 @@
+from concurrent.futures import Future
+from collections import OrderedDict
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Case, surrounding punctuation and repeated whitespace do not change what a search returns."""
+    return " ".join(query.lower().split()).strip(" .?!,;:\"'")
+
+
+class CachedSearchClient:
+    """
+    Wraps a Tavily-compatible client (anything with `search(query, max_results)`).
+    Results are cached per normalized query for `ttl` seconds, and identical searches that
+    arrive while one is in flight wait for that call instead of issuing their own
+    (single-flight), so agents of one crew run and concurrent runs share the result.
+    """
+
+    def __init__(self, client, ttl: float = 3600, max_entries: int = 512):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._results: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+        self._in_flight: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key: tuple) -> dict | None:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.time():
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return result
+
+    def search(self, query: str, max_results: int = 7, **kwargs) -> dict:
+        key = (normalize_query(query), max_results, tuple(sorted(kwargs.items())))
+        with self._lock:
+            result = self._cached(key)
+            if result is not None:
+                logger.info("Web search cache hit")
+                return result
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            logger.info("Joining an in-flight web search for the same query")
+            return future.result()
+
+        try:
+            result = self.client.search(query=query, max_results=max_results, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            with self._lock:
+                self._results[key] = (time.time() + self.ttl, result)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+class OfflineSearchClient:
+    """Local stand-in for TavilyClient returning deterministic results, for tests and benchmarks."""
+
+    def __init__(self, results: list[dict] | None = None, latency: float = 0.0):
+        self.results = results
+        self.latency = latency
+        self.calls = 0
+
+    def search(self, query: str, max_results: int = 7, **kwargs) -> dict:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        results = self.results if self.results is not None else [
+            {
+                "title": f"Offline result {i + 1} for {query}",
+                "url": f"https://example.org/search/{i + 1}",
+                "content": f"Placeholder content about {query}.",
+            }
+            for i in range(max_results)
+        ]
+        return {"query": query, "results": results[:max_results]}
+
+
+def create_search_client() -> CachedSearchClient:
+    """Builds the client selected by WEB_SEARCH_BACKEND ("tavily" or "offline") behind the cache."""
+    backend = os.getenv("WEB_SEARCH_BACKEND", "tavily").lower()
+    if backend == "offline":
+        client = OfflineSearchClient()
+    else:
+        from tavily import TavilyClient
+
+        client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+    return CachedSearchClient(
+        client,
+        ttl=float(os.getenv("WEB_SEARCH_CACHE_TTL", "3600")),
+        max_entries=int(os.getenv("WEB_SEARCH_CACHE_SIZE", "512")),
+    )
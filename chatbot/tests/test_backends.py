@@ -0,0 +1,26 @@
+import asyncio
+
+from babynest.backends import Backends
+
+
+def test_recheck_reports_a_recovered_backend_ready():
+    backends = Backends()
+    state = {"up": False}
+
+    async def check(instance):
+        if not state["up"]:
+            raise ConnectionError("Redis did not answer PING")
+
+    backends.register("store", object, check=check)
+
+    async def scenario():
+        await backends.warm_up()
+        assert not backends.ready()
+        state["up"] = True
+        # Rate limited: a check that just failed is not retried immediately.
+        await backends.recheck()
+        assert not backends.ready()
+        await backends.recheck(min_interval=0)
+        assert backends.ready()
+
+    asyncio.run(scenario())
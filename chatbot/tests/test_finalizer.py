@@ -0,0 +1,18 @@
+from babynest.finalizer import DISCLAIMER, finalize
+
+
+def test_repeated_short_sentences_are_removed():
+    result = finalize("Rest as much as you can and drink plenty of water during the day. Eat well. Eat well. Eat well.")
+    assert result.text.startswith("Rest as much as you can and drink plenty of water during the day. Eat well.\n\n")
+
+
+def test_short_headings_may_repeat_across_paragraphs():
+    draft = "## Tips\n\nSleep on your side in the third trimester if you can.\n\n## Tips\n\nAsk your midwife about pillows that support your back."
+    assert finalize(draft).text.count("## Tips") == 2
+
+
+def test_disclaimer_added_when_the_only_mention_is_truncated():
+    body = " ".join(f"Sentence {i} talks about nutrition and rest." for i in range(40))
+    result = finalize(f"{body} Ask your doctor.")
+    assert result.text.endswith(DISCLAIMER)
+    assert len(result.text) <= 1200
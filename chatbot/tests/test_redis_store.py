@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from babynest.redis_store import InMemoryStore
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def store():
+    store = InMemoryStore()
+    run(store.call("rpush", "items", *[str(i) for i in range(12)]))
+    run(store.call("set", "text", "hello"))
+    return store
+
+
+@pytest.mark.parametrize("start, stop, expected", [
+    (0, -1, [str(i) for i in range(12)]),
+    (0, -11, ["0", "1"]),
+    (0, -12, ["0"]),
+    (0, -13, []),
+    (0, -21, []),
+    (-3, -1, ["9", "10", "11"]),
+    (5, 2, []),
+    (10, 100, ["10", "11"]),
+    (-100, 1, ["0", "1"]),
+])
+def test_lrange_matches_redis(store, start, stop, expected):
+    assert run(store.call("lrange", "items", start, stop)) == expected
+
+
+@pytest.mark.parametrize("start, end, expected", [
+    (0, -1, "hello"),
+    (0, -5, "h"),
+    (0, -6, ""),
+    (0, -10, ""),
+    (1, 3, "ell"),
+    (3, 1, ""),
+    (-3, -1, "llo"),
+])
+def test_getrange_matches_redis(store, start, end, expected):
+    assert run(store.call("getrange", "text", start, end)) == expected
+
+
+def test_ltrim_to_empty_range_deletes_the_list(store):
+    run(store.call("ltrim", "items", 0, -21))
+    assert run(store.call("exists", "items")) == 0
+
+
+def test_ltrim_keeps_the_newest_items(store):
+    run(store.call("ltrim", "items", -4, -1))
+    assert run(store.call("lrange", "items", 0, -1)) == ["8", "9", "10", "11"]
@@ -0,0 +1,40 @@
+import pytest
+
+from babynest.routing import CentroidRouter, keyword_route
+
+
+@pytest.mark.parametrize("query", [
+    "Can you create a report about breastfeeding techniques?",
+    "Write a detailed research report on gestational diabetes screening.",
+    "Please research and summarize WHO guidelines on infant nutrition.",
+    "Help me find clinical evidence for home births.",
+])
+def test_explicit_research_requests_go_to_the_crew(query):
+    assert keyword_route(query) == "crewai"
+
+
+@pytest.mark.parametrize("query", [
+    "guidelines for caffeine",
+    "What do studies say about caffeine in pregnancy?",
+    "Give me a summary of what you said",
+    "I want a quick overview of the first trimester",
+    "I need a summary of my symptoms",
+])
+def test_conversational_requests_stay_out_of_the_crew(query):
+    assert keyword_route(query) != "crewai"
+
+
+class QueryOnlyEmbeddings:
+    """Fails if the router is built from document embeddings."""
+
+    def embed_documents(self, texts):
+        raise AssertionError("examples must be embedded as queries")
+
+    def embed_query(self, text):
+        return [1.0, 0.0] if "report" in text else [0.0, 1.0]
+
+
+def test_build_embeds_examples_as_queries():
+    router = CentroidRouter.build(QueryOnlyEmbeddings(), [("write a report", "crewai"), ("hello there", "langchain")])
+    assert router.classify([1.0, 0.0])[0] == "crewai"
+    assert router.classify([0.0, 1.0])[0] == "langchain"